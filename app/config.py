@@ -10,6 +10,20 @@ class Settings(BaseSettings):
     db_password: str = Field(alias='NUXT_PRIVATE_DB_PASSWORD')
     db_port: int = Field(default=5432, alias='NUXT_PRIVATE_DB_PORT')
     db_name: str = Field(alias='NUXT_PRIVATE_DB_NAME')
+
+    # Database pool - shared asyncpg pool created at startup
+    db_pool_min_size: int = Field(default=10, alias='DB_POOL_MIN_SIZE')
+    db_pool_max_size: int = Field(default=50, alias='DB_POOL_MAX_SIZE')
+    db_pool_max_queries: int = Field(default=50000, alias='DB_POOL_MAX_QUERIES')
+    db_pool_max_inactive_lifetime: float = Field(default=300.0, alias='DB_POOL_MAX_INACTIVE_LIFETIME')
+    db_statement_cache_size: int = Field(default=1024, alias='DB_STATEMENT_CACHE_SIZE')
+    db_statement_cache_lifetime: int = Field(default=0, alias='DB_STATEMENT_CACHE_LIFETIME')  # Seconds before a cached statement is re-prepared; 0 keeps it for the connection's life
+    db_pgbouncer: bool = Field(default=False, alias='DB_PGBOUNCER')  # PgBouncer transaction mode: no statement cache, unique statement names
+    db_read_host: Optional[str] = Field(default=None, alias='DB_READ_HOST')  # Read replica for read-only queries; primary when unset
+
+    # Redis - optional response cache (disabled when REDIS_URL is not set)
+    redis_url: Optional[str] = Field(default=None, alias='REDIS_URL')
+    purchases_list_cache_ttl: int = Field(default=30, alias='PURCHASES_LIST_CACHE_TTL')
     
     # JWT Security - nombres limpios
     jwt_secret: str = Field(alias='NUXT_PRIVATE_JWT_SECRET')
@@ -62,6 +76,10 @@ class Settings(BaseSettings):
             "database": self.db_name,
         }
     
+    @property
+    def db_read_connection_params(self) -> dict:
+        return {**self.db_connection_params, "host": self.db_read_host or self.db_host}
+    
     @property
     def is_development(self) -> bool:
         return self.environment == "development"
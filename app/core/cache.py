@@ -0,0 +1,121 @@
+"""
+Redis response cache
+Caches assembled list responses per tenant. Disabled when REDIS_URL is not set,
+and any Redis failure falls back to the database instead of failing the request.
+"""
+import functools
+import hashlib
+import inspect
+import logging
+from typing import Optional, Type
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from pydantic import BaseModel
+
+from app.config import settings
+from app.core.middleware import require_valid_session
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[redis.Redis] = None
+
+def get_redis() -> Optional[redis.Redis]:
+    """Return the shared Redis client, or None when caching is disabled"""
+    global _client
+    if _client is None and settings.redis_url:
+        _client = redis.from_url(
+            settings.redis_url,
+            decode_responses=True,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+    return _client
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _version_key(namespace: str, tenant_id) -> str:
+    return f"{namespace}:{tenant_id}:version"
+
+async def invalidate_tenant_cache(namespace: str, tenant_id) -> None:
+    """
+    Invalidate every cached response of a namespace for one tenant
+    Bumps the tenant version so old keys are never read again and expire by TTL
+    """
+    client = get_redis()
+    if client is None or not tenant_id:
+        return
+    try:
+        await client.incr(_version_key(namespace, tenant_id))
+    except RedisError as e:
+        logger.warning(f"Cache invalidation failed for {namespace}:{tenant_id}: {e}")
+
+def cached_response(namespace: str, response_model: Type[BaseModel], ttl: int):
+    """
+    Cache a tenant-scoped service response in Redis
+    The key is the tenant, its cache version and a hash of every argument
+    except request/response, e.g. purchases:{tenant_id}:v3:{blake2b hex}
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            client = get_redis()
+            if client is None:
+                return await func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            tenant_id = require_valid_session(bound.arguments['request']).tenant_id
+            if not tenant_id:
+                return await func(*args, **kwargs)
+
+            # Arguments include free user text (search), so they are hashed: no two
+            # filter sets can share a key and the key length stays fixed
+            filters = sorted(
+                (name, value)
+                for name, value in bound.arguments.items()
+                if name not in ('request', 'response')
+            )
+            filters_hash = hashlib.blake2b(repr(filters).encode(), digest_size=16).hexdigest()
+
+            try:
+                version = await client.get(_version_key(namespace, tenant_id)) or "0"
+                key = f"{namespace}:{tenant_id}:v{version}:{filters_hash}"
+                cached = await client.get(key)
+            except RedisError as e:
+                logger.warning(f"Cache read failed for {namespace}:{tenant_id}: {e}")
+                return await func(*args, **kwargs)
+
+            if cached is not None:
+                return response_model.model_validate_json(cached)
+
+            result = await func(*args, **kwargs)
+
+            try:
+                await client.setex(key, ttl, result.model_dump_json())
+            except RedisError as e:
+                logger.warning(f"Cache write failed for {namespace}:{tenant_id}: {e}")
+
+            return result
+        return wrapper
+    return decorator
+
+def invalidates_cache(namespace: str):
+    """
+    Invalidate the tenant's cached responses after a successful mutation
+    Wraps session-scoped service functions; runs after their transaction has committed
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(request, *args, **kwargs):
+            result = await func(request, *args, **kwargs)
+            await invalidate_tenant_cache(namespace, require_valid_session(request).tenant_id)
+            return result
+        return wrapper
+    return decorator
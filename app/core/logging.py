@@ -1,4 +1,7 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 from typing import Dict, Any
 from datetime import datetime
@@ -22,15 +25,22 @@ class ColoredFormatter(logging.Formatter):
             record.levelname = f"{color}{record.levelname}{self.RESET}"
         return super().format(record)
 
+# Writes queued records to the real handlers on a background thread
+_queue_listener = None
+
 def setup_logging():
     """Setup logging configuration compatible with warolabs.com patterns"""
     
+    global _queue_listener
+
     # Root logger configuration
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.DEBUG if settings.debug else logging.INFO)
     
     # Clear existing handlers
     root_logger.handlers.clear()
+    if _queue_listener is not None:
+        _queue_listener.stop()
     
     # Console handler with colors
     console_handler = logging.StreamHandler(sys.stdout)
@@ -41,7 +51,13 @@ def setup_logging():
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     console_handler.setFormatter(console_format)
-    root_logger.addHandler(console_handler)
+
+    # Request handlers only enqueue records; stdout writes happen off the event loop
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _queue_listener = logging.handlers.QueueListener(log_queue, console_handler, respect_handler_level=True)
+    _queue_listener.start()
+    atexit.register(_queue_listener.stop)
     
     # Suppress verbose third-party logs in production
     if not settings.debug:
@@ -1,46 +1,120 @@
+import json
 import asyncpg
+from uuid import uuid4
 from contextlib import asynccontextmanager
 from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _encode_jsonb(value) -> bytes:
+    # jsonb binary format: version byte (1) followed by the JSON text
+    return b'\x01' + json.dumps(value).encode()
+
+def _decode_jsonb(data: bytes):
+    return json.loads(data[1:])
+
+async def _init_connection(connection):
+    # Encode/decode json and jsonb in the driver: queries take and return Python
+    # dicts/lists (e.g. json_agg results, metadata columns) instead of text
+    await connection.set_type_codec(
+        'json',
+        encoder=json.dumps,
+        decoder=json.loads,
+        schema='pg_catalog'
+    )
+    # jsonb travels in binary format, skipping the text I/O conversion
+    await connection.set_type_codec(
+        'jsonb',
+        encoder=_encode_jsonb,
+        decoder=_decode_jsonb,
+        schema='pg_catalog',
+        format='binary'
+    )
+
+def _pool_statement_options() -> dict:
+    if settings.db_pgbouncer:
+        # Server connections are shared between clients in transaction mode, so
+        # cached statements may not exist on the next checkout and fixed names
+        # can collide
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__"
+        }
+    return {
+        "statement_cache_size": settings.db_statement_cache_size,
+        "max_cached_statement_lifetime": settings.db_statement_cache_lifetime
+    }
+
 class DatabasePool:
     _pool = None
+    _read_pool = None
+
+    @staticmethod
+    async def _open_pool(connection_params: dict):
+        return await asyncpg.create_pool(
+            **connection_params,
+            min_size=settings.db_pool_min_size,
+            max_size=settings.db_pool_max_size,
+            max_queries=settings.db_pool_max_queries,
+            max_inactive_connection_lifetime=settings.db_pool_max_inactive_lifetime,
+            **_pool_statement_options(),
+            command_timeout=60,
+            init=_init_connection
+        )
     
     @classmethod
     async def create_pool(cls):
         if cls._pool is None:
             try:
-                cls._pool = await asyncpg.create_pool(
-                    **settings.db_connection_params,
-                    min_size=5,
-                    max_size=20,
-                    command_timeout=60
-                )
-                logger.info(f" Database pool created: {settings.db_name}@{settings.db_host}")
+                cls._pool = await cls._open_pool(settings.db_connection_params)
+                logger.info(f" Database pool created: {settings.db_name}@{settings.db_host}")
             except Exception as e:
                 logger.error(f"L Failed to create database pool: {e}")
                 raise
         return cls._pool
+
+    @classmethod
+    async def create_read_pool(cls):
+        # Without a replica, read-only work shares the primary pool
+        if not settings.db_read_host:
+            return await cls.create_pool()
+        if cls._read_pool is None:
+            try:
+                cls._read_pool = await cls._open_pool(settings.db_read_connection_params)
+                logger.info(f" Read pool created: {settings.db_name}@{settings.db_read_host}")
+            except Exception as e:
+                logger.error(f"L Failed to create read pool: {e}")
+                raise
+        return cls._read_pool
     
     @classmethod
     async def close_pool(cls):
+        if cls._read_pool:
+            await cls._read_pool.close()
+            cls._read_pool = None
+            logger.info("Read pool closed")
         if cls._pool:
             await cls._pool.close()
             cls._pool = None
             logger.info("Database pool closed")
 
 @asynccontextmanager
-async def get_db_connection():
+async def get_db_connection(readonly: bool = False):
     """
     Equivalent to withPostgresClient from warolabs.com
+
+    readonly=True runs the transaction READ ONLY on the read replica pool
+    (DB_READ_HOST), or on the primary when no replica is configured.
     
     Usage:
     async with get_db_connection() as conn:
         result = await conn.fetchrow("SELECT * FROM table WHERE id = $1", id)
     """
-    pool = await DatabasePool.create_pool()
+    if readonly:
+        pool = await DatabasePool.create_read_pool()
+    else:
+        pool = await DatabasePool.create_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            yield connection
\ No newline at end of file
+        async with connection.transaction(readonly=readonly):
+            yield connection
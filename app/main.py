@@ -1,7 +1,12 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import auth, tenants, financial, suppliers, ingredients, purchases, supplier_portal
 from app.config import settings
+from app.database import DatabasePool
+from app.core.cache import close_redis
+from app.services.reference_cache import start_supplier_listener, stop_supplier_listener
 from app.core.logging import setup_logging
 from app.core.exceptions import api_exception_handler, general_exception_handler, APIError
 from app.core.middleware import tenant_detection_middleware, session_validation_middleware, request_logging_middleware
@@ -11,12 +16,26 @@ setup_logging()
 
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared database pool once per process and reuse it across requests
+    await DatabasePool.create_pool()
+    await DatabasePool.create_read_pool()
+    # Drop cached supplier names when any worker updates or deletes a supplier
+    start_supplier_listener()
+    yield
+    await stop_supplier_listener()
+    await DatabasePool.close_pool()
+    await close_redis()
+
 app = FastAPI(
     title="Warolabs FastAPI Service",
     version="1.0.0",
     debug=settings.debug,
     docs_url="/docs",
-    redirect_slashes=True  # Explicitly handle trailing slashes
+    redirect_slashes=True,  # Explicitly handle trailing slashes
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure cookie authentication for Swagger UI
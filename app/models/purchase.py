@@ -367,9 +367,10 @@ class PurchasesListResponse(BaseModel):
     """List of purchases response"""
     success: bool = True
     data: List[Purchase]
-    total: int
+    total: Optional[int] = Field(None, description="Total matching purchases (not computed for cursor pages)")
     page: int = 1
     limit: int = 50
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page (keyset pagination)")
 
 class StatusHistoryResponse(BaseModel):
     """Status history list response"""
@@ -44,6 +44,13 @@ class SupplierResponse(BaseModel):
 class SuppliersListResponse(BaseModel):
     success: bool = True
     data: list[Supplier]
-    total: int
+    total: Optional[int] = Field(None, description="Total matching suppliers (not computed for cursor pages)")
     page: int = 1
-    limit: int = 50
\ No newline at end of file
+    limit: int = 50
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page (keyset pagination)")
+
+class ItemPriceUpdate(BaseModel):
+    """Price of one quotation item sent from the supplier portal"""
+    id: UUID
+    unit_cost: float
+    notes: Optional[str] = None
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, Response, Query, Form, File, UploadFile
+from fastapi import APIRouter, Request, Response, Query, Form, File, UploadFile, BackgroundTasks
 from uuid import UUID
 from typing import Optional, List
 from app.services.purchases_service import (
@@ -65,20 +65,13 @@ async def get_next_purchase_number(
     async with get_db_connection() as conn:
         current_year = datetime.now().year
 
-        last_purchase = await conn.fetchrow("""
-            SELECT purchase_number
-            FROM tenant_purchases
-            WHERE tenant_id = $1
-                AND purchase_number LIKE $2
-            ORDER BY created_at DESC
-            LIMIT 1
-        """, tenant_id, f'WR-{current_year}-%')
+        last_seq = await conn.fetchval("""
+            SELECT last_seq
+            FROM tenant_purchase_counters
+            WHERE tenant_id = $1 AND year = $2
+        """, tenant_id, current_year)
 
-        if last_purchase and last_purchase['purchase_number']:
-            last_number = int(last_purchase['purchase_number'].split('-')[-1])
-            next_number = last_number + 1
-        else:
-            next_number = 1
+        next_number = (last_seq or 0) + 1
 
         return {
             "next_number": f"WR-{current_year}-{next_number:04d}"
@@ -93,14 +86,15 @@ async def get_purchases_endpoint(
     search: Optional[str] = Query(default=None, description="Search by purchase number or invoice number"),
     status: Optional[str] = Query(default=None, description="Filter by status"),
     supplier_id: Optional[UUID] = Query(default=None, description="Filter by supplier ID"),
-    payment_status: Optional[str] = Query(default=None, description="Filter by payment status (pending, overdue, due_this_week)")
+    payment_status: Optional[str] = Query(default=None, description="Filter by payment status (pending, overdue, due_this_week)"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page; takes precedence over page")
 ):
     """
     Get purchases list with tenant isolation
     Requires valid session with tenant context
     """
     return await get_purchases_list(
-        request, response, page, limit, search, status, supplier_id, payment_status
+        request, response, page, limit, search, status, supplier_id, payment_status, cursor
     )
 
 @router.get("/{purchase_id}", response_model=PurchaseResponse)
@@ -118,12 +112,13 @@ async def get_purchase_endpoint(
 async def create_purchase_endpoint(
     purchase_data: PurchaseCreate,
     request: Request,
-    response: Response
+    response: Response,
+    background_tasks: BackgroundTasks
 ):
     """
     Create a new purchase with tenant isolation
     """
-    return await create_purchase(request, response, purchase_data)
+    return await create_purchase(request, response, purchase_data, background_tasks)
 
 @router.put("/{purchase_id}", response_model=PurchaseResponse)
 async def update_purchase_endpoint(
@@ -4,9 +4,11 @@ Public endpoints for suppliers to access their portal using a unique token
 No authentication required - token is used for identification
 """
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import ORJSONResponse
 from uuid import UUID
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
+from app.models.supplier import ItemPriceUpdate
 from app.services.supplier_portal_service import (
     verify_supplier_token,
     get_supplier_purchases,
@@ -23,11 +25,6 @@ router = APIRouter()
 # REQUEST/RESPONSE MODELS
 # =============================================================================
 
-class ItemPriceUpdate(BaseModel):
-    id: str
-    unit_cost: float
-    notes: Optional[str] = None
-
 class UpdatePricesRequest(BaseModel):
     items: List[ItemPriceUpdate]
     tax_amount: float
@@ -94,7 +91,9 @@ async def get_invoices_endpoint(
         start_date: Optional filter by start date (YYYY-MM-DD)
         end_date: Optional filter by end date (YYYY-MM-DD)
     """
-    return await get_supplier_invoices(token, document_type, start_date, end_date)
+    # Rows hold only JSON-native, date and datetime values, which orjson encodes
+    # directly: skip FastAPI's per-value jsonable_encoder pass
+    return ORJSONResponse(await get_supplier_invoices(token, document_type, start_date, end_date))
 
 @router.post("/{token}/invoices/attach-legal")
 async def attach_legal_invoice_endpoint(
@@ -148,12 +147,10 @@ async def update_prices_endpoint(
     except ValueError:
         raise HTTPException(status_code=400, detail="ID de compra inválido")
 
-    items_dict = [item.dict() for item in data.items]
-
     return await update_purchase_prices(
         token=token,
         purchase_id=purchase_uuid,
-        items_prices=items_dict,
+        items_prices=data.items,
         tax_amount=data.tax_amount,
         notes=data.notes
     )
@@ -26,14 +26,15 @@ async def get_suppliers_endpoint(
     limit: int = Query(default=50, ge=1, le=250, description="Items per page"),
     search: Optional[str] = Query(default=None, description="Search by name or tax_id"),
     is_active: Optional[bool] = Query(default=None, description="Filter by active status"),
-    payment_terms: Optional[str] = Query(default=None, description="Filter by payment terms")
+    payment_terms: Optional[str] = Query(default=None, description="Filter by payment terms"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page; takes precedence over page")
 ):
     """
     Get suppliers list with tenant isolation
     Requires valid session with tenant context
     """
     return await get_suppliers_list(
-        request, response, page, limit, search, is_active, payment_terms
+        request, response, page, limit, search, is_active, payment_terms, cursor
     )
 
 @router.get("/{supplier_id}", response_model=SupplierResponse)
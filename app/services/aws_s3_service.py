@@ -2,13 +2,27 @@
 AWS S3 Service for file uploads
 Handles uploading, downloading, and deleting files from S3
 """
+import asyncio
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
-from typing import Optional, BinaryIO
+from typing import Optional, BinaryIO, Union
 from datetime import datetime, timedelta
 from app.config import settings
 import uuid
 import mimetypes
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Uploads stream from the file object in 8 MB parts (multipart above 8 MB), so
+# memory per upload is bounded by the part size. The call already runs in a
+# worker thread, so boto3 does not need its own thread pool
+_UPLOAD_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    use_threads=False
+)
 
 class AWSS3Service:
     def __init__(self):
@@ -70,8 +84,9 @@ class AWSS3Service:
                 if not content_type:
                     content_type = 'application/octet-stream'
 
-            # Upload to S3
-            self.s3_client.upload_fileobj(
+            # Upload to S3 (boto3 blocks, so run it off the event loop)
+            await asyncio.to_thread(
+                self.s3_client.upload_fileobj,
                 file_content,
                 self.bucket_name,
                 s3_key,
@@ -81,7 +96,8 @@ class AWSS3Service:
                         'original_filename': filename,
                         'uploaded_at': datetime.now().isoformat()
                     }
-                }
+                },
+                Config=_UPLOAD_CONFIG
             )
 
             return s3_key
@@ -94,7 +110,7 @@ class AWSS3Service:
 
     async def upload_file_with_key(
         self,
-        file_content: bytes,
+        file_content: Union[bytes, BinaryIO],
         s3_key: str,
         content_type: Optional[str] = None
     ) -> Optional[str]:
@@ -102,7 +118,7 @@ class AWSS3Service:
         Upload a file to S3 with a specific key (path)
 
         Args:
-            file_content: File binary content
+            file_content: File binary content, or a file object streamed in parts
             s3_key: Specific S3 key (full path) to use
             content_type: MIME type of the file
 
@@ -119,8 +135,9 @@ class AWSS3Service:
             if not content_type:
                 content_type = 'application/octet-stream'
 
-            # Upload to S3
-            self.s3_client.upload_fileobj(
+            # Upload to S3 (boto3 blocks, so run it off the event loop)
+            await asyncio.to_thread(
+                self.s3_client.upload_fileobj,
                 file_content,
                 self.bucket_name,
                 s3_key,
@@ -129,16 +146,17 @@ class AWSS3Service:
                     'Metadata': {
                         'uploaded_at': datetime.now().isoformat()
                     }
-                }
+                },
+                Config=_UPLOAD_CONFIG
             )
 
             return s3_key
 
         except ClientError as e:
-            print(f"Error uploading file to S3: {e}")
+            logger.error(f"Error uploading file to S3: {e}")
             return None
         except Exception as e:
-            print(f"Unexpected error uploading file: {e}")
+            logger.exception(f"Unexpected error uploading file: {e}")
             return None
 
     async def get_presigned_url(
@@ -181,7 +199,8 @@ class AWSS3Service:
             True if successful, False if failed
         """
         try:
-            self.s3_client.delete_object(
+            await asyncio.to_thread(
+                self.s3_client.delete_object,
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
@@ -202,7 +221,8 @@ class AWSS3Service:
             Dictionary with file metadata if successful, None if failed
         """
         try:
-            response = self.s3_client.head_object(
+            response = await asyncio.to_thread(
+                self.s3_client.head_object,
                 Bucket=self.bucket_name,
                 Key=s3_key
             )
@@ -215,3 +235,12 @@ class AWSS3Service:
         except ClientError as e:
 
             return None
+
+_service: Optional[AWSS3Service] = None
+
+def get_s3_service() -> AWSS3Service:
+    """Return the shared S3 service; boto3 clients are thread-safe and keep their connection pool"""
+    global _service
+    if _service is None:
+        _service = AWSS3Service()
+    return _service
@@ -0,0 +1,42 @@
+"""
+Batch Fetch Helpers
+Load child rows for many parents in one query instead of one query per parent
+"""
+from collections import defaultdict
+from typing import Dict, List, Sequence
+from uuid import UUID
+from app.models.purchase import PurchaseItem
+
+_SELECT_ITEMS_BY_PURCHASES = """
+    SELECT
+        id,
+        purchase_id,
+        ingredient_id,
+        quantity,
+        unit,
+        unit_cost,
+        total_cost,
+        expiry_date,
+        batch_number,
+        notes,
+        created_at
+    FROM tenant_purchase_items
+    WHERE purchase_id = ANY($1::uuid[])
+"""
+
+async def batch_fetch_purchase_items(conn, purchase_ids: Sequence[UUID]) -> Dict[UUID, List[PurchaseItem]]:
+    """
+    Fetch the items of several purchases in a single query
+
+    Returns:
+        Items grouped by purchase_id; purchases without items are absent
+    """
+    items_by_purchase: Dict[UUID, List[PurchaseItem]] = defaultdict(list)
+    if not purchase_ids:
+        return items_by_purchase
+
+    rows = await conn.fetch(_SELECT_ITEMS_BY_PURCHASES, list(purchase_ids))
+    for row in rows:
+        items_by_purchase[row['purchase_id']].append(PurchaseItem.model_construct(**row))
+
+    return items_by_purchase
@@ -10,7 +10,9 @@ from fastapi import Request, Response, HTTPException, UploadFile
 from app.database import get_db_connection
 from app.core.middleware import require_valid_session
 from app.core.exceptions import AuthenticationError
-from app.services.aws_s3_service import AWSS3Service
+from app.core.cache import invalidates_cache
+from app.services.aws_s3_service import get_s3_service
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,6 +32,7 @@ from app.models.purchase import (
     AttachmentsResponse,
 )
 from app.services.email_helpers import send_purchase_status_notification
+from app.utils.dates import parse_iso_datetime
 
 # =============================================================================
 # STATE TRANSITION RULES
@@ -86,7 +89,7 @@ async def upload_purchase_attachments(
     if not files:
         return
 
-    s3_service = AWSS3Service()
+    s3_service = get_s3_service()
 
     for idx, file in enumerate(files):
         try:
@@ -181,7 +184,6 @@ async def get_purchase_status_history(
             """, purchase_id)
 
             # Parse metadata from JSON string to dict
-            import json
             history = []
             for row in history_data:
                 row_dict = dict(row)
@@ -281,7 +283,7 @@ async def get_transition_detail(
             """, purchase_id, to_status)
 
         # Generate presigned URLs for attachments
-        s3_service = AWSS3Service()
+        s3_service = get_s3_service()
         transition_time = transition_data['changed_at']
         related_attachments = []
 
@@ -308,14 +310,13 @@ async def get_transition_detail(
                         )
                         att_dict['s3_url'] = presigned_url
                     except Exception as e:
-                        print(f"Error generating presigned URL: {e}")
+                        logger.warning(f"Error generating presigned URL: {e}")
                         att_dict['s3_url'] = None
                 else:
                     att_dict['s3_url'] = None
                 related_attachments.append(att_dict)
 
         # Parse transition metadata
-        import json
         transition_dict = dict(transition_data)
 
         # Extract user info
@@ -368,11 +369,6 @@ async def create_status_history_entry(
     notes: Optional[str] = None
 ):
     """Create a status history entry"""
-    import json
-
-    # Convert metadata dict to JSON string for JSONB column
-    metadata_json = json.dumps(metadata) if metadata else '{}'
-
     await conn.execute("""
         INSERT INTO purchase_status_history (
             purchase_id,
@@ -384,7 +380,7 @@ async def create_status_history_entry(
             notes
         ) VALUES ($1, $2, $3, $4, $5, $6::jsonb, $7)
     """, purchase_id, tenant_id, from_status, to_status, changed_by,
-    metadata_json, notes)
+    metadata or {}, notes)
 
 # =============================================================================
 # ATTACHMENT FUNCTIONS
@@ -436,7 +432,7 @@ async def get_purchase_attachments(
             """, purchase_id)
 
             # Generate presigned URLs for each attachment
-            s3_service = AWSS3Service()
+            s3_service = get_s3_service()
             attachments = []
             for row in attachments_data:
                 row_dict = dict(row)
@@ -449,7 +445,7 @@ async def get_purchase_attachments(
                         )
                         row_dict['s3_url'] = presigned_url
                     except Exception as e:
-                        print(f"Error generating presigned URL for attachment {row_dict['id']}: {e}")
+                        logger.warning(f"Error generating presigned URL for attachment {row_dict['id']}: {e}")
                         row_dict['s3_url'] = None
                 else:
                     row_dict['s3_url'] = None
@@ -535,6 +531,7 @@ async def create_purchase_attachment(
 # STATE TRANSITION FUNCTIONS
 # =============================================================================
 
+@invalidates_cache("purchases")
 async def transition_to_confirmed(
     request: Request,
     response: Response,
@@ -631,6 +628,7 @@ async def transition_to_confirmed(
 
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@invalidates_cache("purchases")
 async def transition_to_shipped(
     request: Request,
     response: Response,
@@ -656,7 +654,7 @@ async def transition_to_shipped(
         estimated_delivery_dt = None
         if estimated_delivery_date:
             try:
-                estimated_delivery_dt = datetime.fromisoformat(estimated_delivery_date.replace('Z', '+00:00'))
+                estimated_delivery_dt = parse_iso_datetime(estimated_delivery_date)
             except:
                 pass
 
@@ -761,6 +759,7 @@ async def transition_to_shipped(
 
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@invalidates_cache("purchases")
 async def transition_to_received(
     request: Request,
     response: Response,
@@ -781,7 +780,6 @@ async def transition_to_received(
             raise AuthenticationError("Tenant ID is required")
 
         # Parse items data from JSON string
-        import json
         try:
             items = json.loads(items_data)
         except json.JSONDecodeError:
@@ -908,6 +906,7 @@ async def transition_to_received(
 
 # Function transition_to_verified removed - verification now happens during reception
 
+@invalidates_cache("purchases")
 async def transition_to_invoiced(
     request: Request,
     response: Response,
@@ -934,14 +933,14 @@ async def transition_to_invoiced(
         # Parse dates
         from datetime import datetime, timedelta
         try:
-            invoice_dt = datetime.fromisoformat(invoice_date.replace('Z', '+00:00'))
+            invoice_dt = parse_iso_datetime(invoice_date)
         except:
             invoice_dt = datetime.now()
 
         payment_due_dt = None
         if payment_due_date:
             try:
-                payment_due_dt = datetime.fromisoformat(payment_due_date.replace('Z', '+00:00'))
+                payment_due_dt = parse_iso_datetime(payment_due_date)
             except:
                 pass
 
@@ -1066,6 +1065,7 @@ async def transition_to_invoiced(
 
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@invalidates_cache("purchases")
 async def transition_to_paid(
     request: Request,
     response: Response,
@@ -1089,7 +1089,7 @@ async def transition_to_paid(
         # Parse payment_date
         from datetime import datetime
         try:
-            payment_dt = datetime.fromisoformat(payment_date.replace('Z', '+00:00'))
+            payment_dt = parse_iso_datetime(payment_date)
         except:
             payment_dt = datetime.now()
 
@@ -1190,6 +1190,7 @@ async def transition_to_paid(
         logger.error(f"Error in transition_to_paid: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error registrando pago: {str(e)}")
 
+@invalidates_cache("purchases")
 async def cancel_purchase(
     request: Request,
     response: Response,
@@ -1256,6 +1257,7 @@ async def cancel_purchase(
 # QUOTATION COMPLETION
 # =============================================================================
 
+@invalidates_cache("purchases")
 async def complete_quotation(
     request: Request,
     response: Response,
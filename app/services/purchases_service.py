@@ -1,9 +1,15 @@
-from typing import Optional, Dict, Any
+import logging
+from functools import lru_cache
+from itertools import product
+from typing import Optional, Dict, Any, List, Tuple
 from uuid import UUID
-from fastapi import Request, Response, HTTPException
+from fastapi import Request, Response, HTTPException, BackgroundTasks
 from app.database import get_db_connection
 from app.core.middleware import require_valid_session
 from app.core.exceptions import AuthenticationError
+from app.core.cache import cached_response, invalidates_cache, invalidate_tenant_cache
+from app.config import settings
+from app.utils.pagination import encode_cursor, decode_cursor
 from app.models.purchase import (
     Purchase,
     PurchaseCreate,
@@ -13,7 +19,439 @@ from app.models.purchase import (
     PurchasesListResponse
 )
 from app.services.email_helpers import send_quotation_email
+from app.services.batch import batch_fetch_purchase_items
+from app.services.reference_cache import get_ingredients_meta, get_supplier_names
+
+logger = logging.getLogger(__name__)
+
+_SELECT_ITEMS_BY_PURCHASE = """
+    SELECT
+        id,
+        purchase_id,
+        ingredient_id,
+        quantity,
+        unit,
+        unit_cost,
+        total_cost,
+        expiry_date,
+        batch_number,
+        notes,
+        created_at
+    FROM tenant_purchase_items
+    WHERE purchase_id = $1
+"""
+
+# Status history of a purchase as a json array, in the same shape as the
+# status_history of _SELECT_PURCHASE_DETAIL
+_SELECT_STATUS_HISTORY_JSON = """
+    SELECT COALESCE(json_agg(h ORDER BY h.changed_at ASC), '[]'::json)
+    FROM (
+        SELECT
+            id,
+            from_status,
+            to_status,
+            changed_at,
+            metadata::text as metadata,
+            notes
+        FROM purchase_status_history
+        WHERE purchase_id = $1
+    ) h
+"""
+
+# Purchase detail in one round trip: items and status history are aggregated
+# as json arrays alongside the purchase row
+_SELECT_PURCHASE_DETAIL = """
+    SELECT
+        tp.id,
+        tp.tenant_id,
+        tp.supplier_id,
+        ts.name as supplier_name,
+        tp.purchase_number,
+        tp.purchase_date,
+        tp.delivery_date,
+        tp.total_amount,
+        tp.tax_amount,
+        tp.status,
+        tp.invoice_number,
+        tp.notes,
+        tp.created_by,
+        tp.created_at,
+        tp.updated_at,
+        tp.payment_type,
+        tp.payment_terms,
+        tp.credit_days,
+        tp.payment_due_date,
+        tp.requires_advance_payment,
+        tp.consolidation_group,
+        tp.payment_balance,
+        tp.invoice_date,
+        tp.invoice_amount,
+        (
+            SELECT COALESCE(json_agg(i), '[]'::json)
+            FROM (
+                -- numerics as text so they parse to Decimal with their scale intact
+                SELECT
+                    id,
+                    purchase_id,
+                    ingredient_id,
+                    quantity::text as quantity,
+                    unit,
+                    unit_cost::text as unit_cost,
+                    total_cost::text as total_cost,
+                    expiry_date,
+                    batch_number,
+                    notes,
+                    created_at
+                FROM tenant_purchase_items
+                WHERE purchase_id = tp.id
+            ) i
+        ) as items,
+        (
+            SELECT COALESCE(json_agg(h ORDER BY h.changed_at ASC), '[]'::json)
+            FROM (
+                SELECT
+                    id,
+                    from_status,
+                    to_status,
+                    changed_at,
+                    metadata::text as metadata,
+                    notes
+                FROM purchase_status_history
+                WHERE purchase_id = tp.id
+            ) h
+        ) as status_history
+    FROM tenant_purchases tp
+    LEFT JOIN tenant_suppliers ts ON tp.supplier_id = ts.id
+    WHERE tp.id = $1 AND tp.tenant_id = $2
+"""
+
+# Allocates the next WR-YYYY-NNNN number for the tenant/year ($3 = year) and
+# inserts the purchase in the same statement. The counter row lock serializes
+# concurrent creations, so numbers are never duplicated.
+_INSERT_PURCHASE = """
+    WITH seq AS (
+        INSERT INTO tenant_purchase_counters (tenant_id, year, last_seq)
+        VALUES ($1, $3, 1)
+        ON CONFLICT (tenant_id, year) DO UPDATE
+            SET last_seq = tenant_purchase_counters.last_seq + 1,
+                updated_at = NOW()
+        RETURNING year, last_seq
+    )
+    INSERT INTO tenant_purchases (
+        tenant_id,
+        supplier_id,
+        purchase_number,
+        purchase_date,
+        delivery_date,
+        total_amount,
+        tax_amount,
+        status,
+        invoice_number,
+        notes,
+        created_by,
+        payment_type,
+        payment_terms,
+        credit_days,
+        requires_advance_payment,
+        consolidation_group,
+        payment_balance
+    )
+    SELECT
+        $1, $2,
+        format('WR-%s-%s', seq.year, lpad(seq.last_seq::text, GREATEST(4, length(seq.last_seq::text)), '0')),
+        $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17
+    FROM seq
+    RETURNING
+        id,
+        tenant_id,
+        supplier_id,
+        purchase_number,
+        purchase_date,
+        delivery_date,
+        total_amount,
+        tax_amount,
+        status,
+        invoice_number,
+        notes,
+        created_by,
+        created_at,
+        updated_at,
+        payment_type,
+        payment_terms,
+        credit_days,
+        requires_advance_payment,
+        consolidation_group,
+        payment_balance
+"""
+
+# All items of a purchase in one statement: one array parameter per column.
+# The join drops items whose ingredient is unknown or whose unit differs from the
+# ingredient's base unit, so fewer returned rows than items means a validation error
+_INSERT_PURCHASE_ITEMS = """
+    INSERT INTO tenant_purchase_items (
+        purchase_id,
+        ingredient_id,
+        quantity,
+        unit,
+        unit_cost,
+        total_cost,
+        expiry_date,
+        batch_number,
+        notes
+    )
+    SELECT
+        $1,
+        x.ingredient_id,
+        x.quantity,
+        x.unit,
+        x.unit_cost,
+        x.total_cost,
+        x.expiry_date,
+        x.batch_number,
+        x.notes
+    FROM unnest(
+        $2::uuid[],
+        $3::numeric[],
+        $4::text[],
+        $5::numeric[],
+        $6::numeric[],
+        $7::date[],
+        $8::text[],
+        $9::text[]
+    ) AS x(ingredient_id, quantity, unit, unit_cost, total_cost, expiry_date, batch_number, notes)
+    JOIN ingredients i ON i.id = x.ingredient_id AND i.unit = x.unit
+    RETURNING
+        id,
+        purchase_id,
+        ingredient_id,
+        quantity,
+        unit,
+        unit_cost,
+        total_cost,
+        expiry_date,
+        batch_number,
+        notes,
+        created_at
+"""
+
+_DELETE_PURCHASE_ITEMS = """
+    DELETE FROM tenant_purchase_items
+    WHERE purchase_id = $1
+"""
+
+# Columns update_purchase may SET, in a fixed order so the SQL text only depends
+# on which fields were sent
+_UPDATE_PURCHASE_COLUMNS: Tuple[str, ...] = tuple(
+    field for field in PurchaseUpdate.model_fields if field != 'items'
+)
+_UPDATE_PURCHASE_ALLOWED = frozenset(_UPDATE_PURCHASE_COLUMNS)
 
+@lru_cache(maxsize=256)
+def _build_update_purchase_query(fields: frozenset) -> Tuple[str, Tuple[str, ...]]:
+    """
+    Build the UPDATE for a set of PurchaseUpdate fields
+
+    Returns:
+        (query, columns) where columns is the order of params $3, $4, ...
+    """
+    unknown = fields - _UPDATE_PURCHASE_ALLOWED
+    if unknown:
+        raise ValueError(f"Columns not allowed in purchase update: {sorted(unknown)}")
+
+    columns = tuple(column for column in _UPDATE_PURCHASE_COLUMNS if column in fields)
+    update_fields = [f"{column} = ${index}" for index, column in enumerate(columns, start=3)]
+    update_fields.append("updated_at = NOW()")
+
+    # The UPDATE doubles as the tenant ownership check and returns the row used
+    # to build the response
+    query = f"""
+        WITH updated AS (
+            UPDATE tenant_purchases
+            SET {', '.join(update_fields)}
+            WHERE id = $1 AND tenant_id = $2
+            RETURNING *
+        )
+        SELECT updated.*, ts.name as supplier_name
+        FROM updated
+        LEFT JOIN tenant_suppliers ts ON updated.supplier_id = ts.id
+    """
+    return query, columns
+
+_SELECT_QUOTATION_EMAIL_DATA = """
+    SELECT
+        tp.purchase_number,
+        tp.purchase_date,
+        tp.delivery_date,
+        tp.notes,
+        tp.payment_type,
+        tp.payment_terms,
+        tp.credit_days,
+        tp.requires_advance_payment,
+        tp.consolidation_group,
+        ts.name as supplier_name,
+        ts.email as supplier_email,
+        ts.access_token,
+        site.site as tenant_site
+    FROM tenant_purchases tp
+    JOIN tenant_suppliers ts ON ts.id = tp.supplier_id AND ts.tenant_id = tp.tenant_id
+    LEFT JOIN LATERAL (
+        SELECT site FROM tenant_sites
+        WHERE tenant_id = tp.tenant_id AND is_active = true
+        LIMIT 1
+    ) site ON true
+    WHERE tp.id = $1 AND tp.tenant_id = $2
+"""
+
+_SELECT_QUOTATION_EMAIL_ITEMS = """
+    SELECT
+        COALESCE(i.name, 'Producto') as ingredient_name,
+        tpi.quantity,
+        tpi.unit
+    FROM tenant_purchase_items tpi
+    LEFT JOIN ingredients i ON i.id = tpi.ingredient_id
+    WHERE tpi.purchase_id = $1
+"""
+
+# Purchases list: the page of tenant_purchases is selected first (filters,
+# order, limit) and only those rows are joined to payment history (supplier
+# names come from the reference cache). In page mode the page also carries the filtered total via COUNT(*) OVER ()
+_PURCHASES_LIST_SELECT = """
+    SELECT
+        tp.id,
+        tp.tenant_id,
+        tp.supplier_id,
+        tp.purchase_number,
+        tp.purchase_date,
+        tp.delivery_date,
+        tp.total_amount,
+        tp.tax_amount,
+        tp.status,
+        tp.invoice_number,
+        tp.notes,
+        tp.created_by,
+        tp.created_at,
+        tp.updated_at,
+        tp.payment_type,
+        tp.payment_terms,
+        tp.credit_days,
+        tp.payment_due_date,
+        tp.requires_advance_payment,
+        tp.consolidation_group,
+        tp.payment_balance,
+        tp.invoice_date,
+        tp.invoice_amount,
+        tp.payment_method,
+        tp.payment_reference,
+        tp.payment_amount,
+        tp.payment_date,
+        tp.paid_at,
+        tp._total,
+        -- Fall back to the latest paid history row (copied onto the purchase by trigger)
+        COALESCE(tp.payment_method, tp.paid_payment_method) as payment_method_final,
+        COALESCE(tp.payment_reference, tp.paid_payment_reference) as payment_reference_final,
+        COALESCE(tp.payment_date, tp.paid_changed_at) as payment_date_final,
+        CASE
+            WHEN tp.paid_at IS NOT NULL OR tp.paid_changed_at IS NOT NULL THEN true
+            ELSE false
+        END as has_payment
+    FROM (
+"""
+
+_PURCHASES_LIST_ORDER = """
+    ) tp
+    ORDER BY tp.created_at DESC, tp.id DESC
+"""
+
+_PURCHASES_LIST_PAGE = """
+        SELECT tp.*, COUNT(*) OVER () as _total
+        FROM tenant_purchases tp
+        WHERE tp.tenant_id = $1
+"""
+
+# Keyset pages skip the total: it is not needed for infinite scroll
+_PURCHASES_LIST_KEYSET_PAGE = """
+        SELECT tp.*, NULL::bigint as _total
+        FROM tenant_purchases tp
+        WHERE tp.tenant_id = $1
+"""
+
+# Only used when an OFFSET page comes back empty and carries no _total
+_PURCHASES_LIST_COUNT = """
+    SELECT COUNT(*) as total
+    FROM tenant_purchases tp
+    WHERE tp.tenant_id = $1
+"""
+
+_PAYMENT_STATUS_FILTERS = {
+    'overdue': " AND tp.payment_due_date < NOW()",
+    'due_this_week': " AND tp.payment_due_date >= NOW() AND tp.payment_due_date <= NOW() + INTERVAL '7 days'",
+    'pending': " AND (tp.payment_due_date IS NULL OR tp.payment_due_date > NOW() + INTERVAL '7 days')",
+}
+
+def _build_list_queries(
+    has_search: bool,
+    has_status: bool,
+    has_supplier: bool,
+    payment_status: Optional[str],
+    has_cursor: bool
+) -> Tuple[str, str]:
+    """
+    Build (list_query, count_query) for a combination of filters.
+    Params are bound in order: tenant_id, search, status, supplier_id, then
+    cursor created_at and id (keyset) or limit and offset (page)
+    """
+    filters = ""
+    param_count = 2
+
+    if has_search:
+        # ILIKE (not LOWER() LIKE LOWER()) so the trigram index can be used
+        filters += f" AND (tp.purchase_number ILIKE ${param_count} OR tp.invoice_number ILIKE ${param_count})"
+        param_count += 1
+
+    if has_status:
+        filters += f" AND LOWER(tp.status) = LOWER(${param_count})"
+        param_count += 1
+
+    if has_supplier:
+        filters += f" AND tp.supplier_id = ${param_count}"
+        param_count += 1
+
+    if payment_status:
+        filters += _PAYMENT_STATUS_FILTERS[payment_status]
+
+    count_query = _PURCHASES_LIST_COUNT + filters
+
+    if has_cursor:
+        # Keyset: seek past the last row of the previous page, no rows discarded
+        page_query = (
+            _PURCHASES_LIST_KEYSET_PAGE + filters
+            + f" AND (tp.created_at, tp.id) < (${param_count}, ${param_count + 1})"
+            + f" ORDER BY tp.created_at DESC, tp.id DESC LIMIT ${param_count + 2}"
+        )
+    else:
+        page_query = (
+            _PURCHASES_LIST_PAGE + filters
+            + f" ORDER BY tp.created_at DESC, tp.id DESC LIMIT ${param_count} OFFSET ${param_count + 1}"
+        )
+
+    list_query = _PURCHASES_LIST_SELECT + page_query + _PURCHASES_LIST_ORDER
+    return list_query, count_query
+
+# Rows fetched per round-trip when streaming the purchases list
+_LIST_CURSOR_PREFETCH = 100
+
+# Every filter combination is built once at import, so a request only does a
+# dict lookup and always sends the same text for the same filter shape
+_LIST_VARIANTS: Dict[Tuple[bool, bool, bool, Optional[str], bool], Tuple[str, str]] = {
+    key: _build_list_queries(*key)
+    for key in product(
+        (False, True), (False, True), (False, True),
+        (None, *_PAYMENT_STATUS_FILTERS),
+        (False, True)
+    )
+}
+
+@cached_response("purchases", PurchasesListResponse, ttl=settings.purchases_list_cache_ttl)
 async def get_purchases_list(
     request: Request,
     response: Response,
@@ -22,10 +460,12 @@ async def get_purchases_list(
     search: Optional[str] = None,
     status: Optional[str] = None,
     supplier_id: Optional[UUID] = None,
-    payment_status: Optional[str] = None  # pending, overdue, due_this_week
+    payment_status: Optional[str] = None,  # pending, overdue, due_this_week
+    cursor: Optional[str] = None
 ) -> PurchasesListResponse:
     """
     Get purchases list with tenant isolation
+    Pages by cursor (keyset) when given, otherwise by page/limit
     """
     try:
         session_context = require_valid_session(request)
@@ -35,178 +475,69 @@ async def get_purchases_list(
             raise AuthenticationError("Tenant ID is required")
 
         async with get_db_connection() as conn:
-            # Build query with tenant isolation, supplier name, and payment history
-            base_query = """
-                SELECT
-                    tp.id,
-                    tp.tenant_id,
-                    tp.supplier_id,
-                    tp.purchase_number,
-                    tp.purchase_date,
-                    tp.delivery_date,
-                    tp.total_amount,
-                    tp.tax_amount,
-                    tp.status,
-                    tp.invoice_number,
-                    tp.notes,
-                    tp.created_by,
-                    tp.created_at,
-                    tp.updated_at,
-                    tp.payment_type,
-                    tp.payment_terms,
-                    tp.credit_days,
-                    tp.payment_due_date,
-                    tp.requires_advance_payment,
-                    tp.consolidation_group,
-                    tp.payment_balance,
-                    tp.invoice_date,
-                    tp.invoice_amount,
-                    tp.payment_method,
-                    tp.payment_reference,
-                    tp.payment_amount,
-                    tp.payment_date,
-                    tp.paid_at,
-                    ts.name as supplier_name,
-                    -- Get payment info from history if not in main table
-                    COALESCE(tp.payment_method, psh_paid.metadata->>'payment_method') as payment_method_final,
-                    COALESCE(tp.payment_reference, psh_paid.metadata->>'payment_reference') as payment_reference_final,
-                    COALESCE(tp.payment_date, psh_paid.changed_at) as payment_date_final,
-                    CASE
-                        WHEN tp.paid_at IS NOT NULL OR psh_paid.id IS NOT NULL THEN true
-                        ELSE false
-                    END as has_payment
-                FROM tenant_purchases tp
-                LEFT JOIN tenant_suppliers ts ON tp.supplier_id = ts.id
-                LEFT JOIN LATERAL (
-                    SELECT id, changed_at, metadata
-                    FROM purchase_status_history
-                    WHERE purchase_id = tp.id
-                    AND to_status = 'paid'
-                    ORDER BY changed_at DESC
-                    LIMIT 1
-                ) psh_paid ON true
-                WHERE tp.tenant_id = $1
-            """
-
-            count_query = """
-                SELECT COUNT(*) as total
-                FROM tenant_purchases tp
-                WHERE tp.tenant_id = $1
-            """
+            # Query text depends only on which filters are present, so the
+            # prebuilt variant is reused and asyncpg's statement cache hits
+            if payment_status not in _PAYMENT_STATUS_FILTERS:
+                payment_status = None
+            base_query, count_query = _LIST_VARIANTS[
+                (bool(search), bool(status), bool(supplier_id), payment_status, bool(cursor))
+            ]
 
             params = [tenant_id]
-            param_count = 2
-
-            # Add filters
             if search:
-                base_query += f" AND (LOWER(tp.purchase_number) LIKE LOWER(${param_count}) OR LOWER(tp.invoice_number) LIKE LOWER(${param_count}))"
-                count_query += f" AND (LOWER(tp.purchase_number) LIKE LOWER(${param_count}) OR LOWER(tp.invoice_number) LIKE LOWER(${param_count}))"
                 params.append(f"%{search}%")
-                param_count += 1
-
             if status:
-                base_query += f" AND LOWER(tp.status) = LOWER(${param_count})"
-                count_query += f" AND LOWER(tp.status) = LOWER(${param_count})"
                 params.append(status)
-                param_count += 1
-
             if supplier_id:
-                base_query += f" AND tp.supplier_id = ${param_count}"
-                count_query += f" AND tp.supplier_id = ${param_count}"
                 params.append(supplier_id)
-                param_count += 1
-
-            # Payment status filter
-            if payment_status:
-                if payment_status == 'overdue':
-                    base_query += f" AND tp.payment_due_date < NOW()"
-                    count_query += f" AND tp.payment_due_date < NOW()"
-                elif payment_status == 'due_this_week':
-                    base_query += f" AND tp.payment_due_date >= NOW() AND tp.payment_due_date <= NOW() + INTERVAL '7 days'"
-                    count_query += f" AND tp.payment_due_date >= NOW() AND tp.payment_due_date <= NOW() + INTERVAL '7 days'"
-                elif payment_status == 'pending':
-                    base_query += f" AND (tp.payment_due_date IS NULL OR tp.payment_due_date > NOW() + INTERVAL '7 days')"
-                    count_query += f" AND (tp.payment_due_date IS NULL OR tp.payment_due_date > NOW() + INTERVAL '7 days')"
 
             # Add pagination
-            offset = (page - 1) * limit
-            base_query += f" ORDER BY tp.created_at DESC LIMIT ${param_count} OFFSET ${param_count + 1}"
-            params.extend([limit, offset])
-
-            # Execute queries
-            purchases_data = await conn.fetch(base_query, *params)
-            count_result = await conn.fetchrow(count_query, *params[:-2])
-
-            # Convert to models and fetch items
+            filter_params = list(params)
+            if cursor:
+                params.extend([*decode_cursor(cursor), limit])
+            else:
+                offset = (page - 1) * limit
+                params.extend([limit, offset])
+
+            # Stream rows through a server-side cursor (get_db_connection already
+            # opened the transaction) and build models as each batch arrives.
+            # Rows are already typed by the database, so models skip validation
             purchases = []
-            for row in purchases_data:
-                # Fetch items for this purchase
-                items_data = await conn.fetch("""
-                    SELECT
-                        id,
-                        purchase_id,
-                        ingredient_id,
-                        quantity,
-                        unit,
-                        unit_cost,
-                        total_cost,
-                        expiry_date,
-                        batch_number,
-                        notes,
-                        created_at
-                    FROM tenant_purchase_items
-                    WHERE purchase_id = $1
-                """, row['id'])
-
-                items = [PurchaseItem(**item) for item in items_data]
-
-                purchase = Purchase(
-                    id=row['id'],
-                    tenant_id=row['tenant_id'],
-                    supplier_id=row['supplier_id'],
-                    supplier_name=row['supplier_name'],  # Include supplier name from JOIN
-                    purchase_number=row['purchase_number'],
-                    purchase_date=row['purchase_date'],
-                    delivery_date=row['delivery_date'],
-                    total_amount=row['total_amount'],
-                    tax_amount=row['tax_amount'],
-                    status=row['status'],
-                    payment_type=row['payment_type'],
-                    payment_terms=row['payment_terms'],
-                    credit_days=row['credit_days'],
-                    payment_due_date=row['payment_due_date'],
-                    requires_advance_payment=row['requires_advance_payment'],
-                    consolidation_group=row['consolidation_group'],
-                    payment_balance=row['payment_balance'],
-                    invoice_date=row['invoice_date'],
-                    invoice_amount=row['invoice_amount'],
-                    invoice_number=row['invoice_number'],
-                    notes=row['notes'],
-                    created_by=row['created_by'],
-                    created_at=row['created_at'],
-                    updated_at=row['updated_at'],
-                    payment_method=row.get('payment_method'),
-                    payment_reference=row.get('payment_reference'),
-                    payment_amount=row.get('payment_amount'),
-                    payment_date=row.get('payment_date'),
-                    paid_at=row.get('paid_at'),
-                    payment_method_final=row.get('payment_method_final'),
-                    payment_reference_final=row.get('payment_reference_final'),
-                    payment_date_final=row.get('payment_date_final'),
-                    has_payment=row.get('has_payment'),
-                    items=items
-                )
-                purchases.append(purchase)
+            total = None
+            async for row in conn.cursor(base_query, *params, prefetch=_LIST_CURSOR_PREFETCH):
+                total = row['_total']
+                # Selected columns map 1:1 to Purchase fields (_total is ignored);
+                # supplier_name is filled from the reference cache below
+                purchases.append(Purchase.model_construct(**row, items=[]))
+
+            # Load the items of the whole page in one query instead of one per purchase
+            items_by_purchase = await batch_fetch_purchase_items(conn, [p.id for p in purchases])
+            supplier_names = await get_supplier_names(conn, [p.supplier_id for p in purchases])
+            for purchase in purchases:
+                purchase.items = items_by_purchase.get(purchase.id, [])
+                purchase.supplier_name = supplier_names.get(purchase.supplier_id)
+
+            # Past the last page there is no row to carry the total
+            if not cursor and not purchases:
+                total = await conn.fetchval(count_query, *filter_params) if offset else 0
+
+            # A full page means there may be more rows after the last one
+            next_cursor = None
+            if len(purchases) == limit:
+                next_cursor = encode_cursor(row['created_at'], row['id'])
 
             return PurchasesListResponse(
                 data=purchases,
-                total=count_result['total'],
+                total=total,
                 page=page,
-                limit=limit
+                limit=limit,
+                next_cursor=next_cursor
             )
 
     except AuthenticationError:
         raise
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
@@ -226,106 +557,47 @@ async def get_purchase_by_id(
             raise AuthenticationError("Tenant ID is required")
 
         async with get_db_connection() as conn:
-            purchase_data = await conn.fetchrow("""
-                SELECT
-                    tp.id,
-                    tp.tenant_id,
-                    tp.supplier_id,
-                    ts.name as supplier_name,
-                    tp.purchase_number,
-                    tp.purchase_date,
-                    tp.delivery_date,
-                    tp.total_amount,
-                    tp.tax_amount,
-                    tp.status,
-                    tp.invoice_number,
-                    tp.notes,
-                    tp.created_by,
-                    tp.created_at,
-                    tp.updated_at,
-                    tp.payment_type,
-                    tp.payment_terms,
-                    tp.credit_days,
-                    tp.payment_due_date,
-                    tp.requires_advance_payment,
-                    tp.consolidation_group,
-                    tp.payment_balance,
-                    tp.invoice_date,
-                    tp.invoice_amount
-                FROM tenant_purchases tp
-                LEFT JOIN tenant_suppliers ts ON tp.supplier_id = ts.id
-                WHERE tp.id = $1 AND tp.tenant_id = $2
-            """, purchase_id, tenant_id)
-
-            if not purchase_data:
-                raise HTTPException(status_code=404, detail="Purchase not found")
-
-            # Fetch items
-            items_data = await conn.fetch("""
-                SELECT
-                    id,
-                    purchase_id,
-                    ingredient_id,
-                    quantity,
-                    unit,
-                    unit_cost,
-                    total_cost,
-                    expiry_date,
-                    batch_number,
-                    notes,
-                    created_at
-                FROM tenant_purchase_items
-                WHERE purchase_id = $1
-            """, purchase_id)
-
-            items = [PurchaseItem(**item) for item in items_data]
-
-            # Fetch status history
-            history_data = await conn.fetch("""
-                SELECT
-                    id,
-                    from_status,
-                    to_status,
-                    changed_at,
-                    metadata,
-                    notes
-                FROM purchase_status_history
-                WHERE purchase_id = $1
-                ORDER BY changed_at ASC
-            """, purchase_id)
-
-            status_history = [dict(row) for row in history_data]
-
-            purchase = Purchase(
-                id=purchase_data['id'],
-                tenant_id=purchase_data['tenant_id'],
-                supplier_id=purchase_data['supplier_id'],
-                supplier_name=purchase_data['supplier_name'],
-                purchase_number=purchase_data['purchase_number'],
-                purchase_date=purchase_data['purchase_date'],
-                delivery_date=purchase_data['delivery_date'],
-                total_amount=purchase_data['total_amount'],
-                tax_amount=purchase_data['tax_amount'],
-                status=purchase_data['status'],
-                invoice_number=purchase_data['invoice_number'],
-                notes=purchase_data['notes'],
-                created_by=purchase_data['created_by'],
-                created_at=purchase_data['created_at'],
-                updated_at=purchase_data['updated_at'],
-                payment_type=purchase_data['payment_type'],
-                payment_terms=purchase_data['payment_terms'],
-                credit_days=purchase_data['credit_days'],
-                payment_due_date=purchase_data['payment_due_date'],
-                requires_advance_payment=purchase_data['requires_advance_payment'],
-                consolidation_group=purchase_data['consolidation_group'],
-                payment_balance=purchase_data['payment_balance'],
-                invoice_date=purchase_data['invoice_date'],
-                invoice_amount=purchase_data['invoice_amount'],
-                items=items,
-                status_history=status_history
-            )
-
-            return PurchaseResponse(data=purchase)
+            purchase_data = await conn.fetchrow(_SELECT_PURCHASE_DETAIL, purchase_id, tenant_id)
+
+        if not purchase_data:
+            raise HTTPException(status_code=404, detail="Purchase not found")
+
+        # Items arrive as decoded json, so they are validated to restore
+        # UUID/Decimal/datetime types
+        items = [PurchaseItem.model_validate(item) for item in purchase_data['items']]
+
+        status_history = purchase_data['status_history']
+
+        purchase = Purchase.model_construct(
+            id=purchase_data['id'],
+            tenant_id=purchase_data['tenant_id'],
+            supplier_id=purchase_data['supplier_id'],
+            supplier_name=purchase_data['supplier_name'],
+            purchase_number=purchase_data['purchase_number'],
+            purchase_date=purchase_data['purchase_date'],
+            delivery_date=purchase_data['delivery_date'],
+            total_amount=purchase_data['total_amount'],
+            tax_amount=purchase_data['tax_amount'],
+            status=purchase_data['status'],
+            invoice_number=purchase_data['invoice_number'],
+            notes=purchase_data['notes'],
+            created_by=purchase_data['created_by'],
+            created_at=purchase_data['created_at'],
+            updated_at=purchase_data['updated_at'],
+            payment_type=purchase_data['payment_type'],
+            payment_terms=purchase_data['payment_terms'],
+            credit_days=purchase_data['credit_days'],
+            payment_due_date=purchase_data['payment_due_date'],
+            requires_advance_payment=purchase_data['requires_advance_payment'],
+            consolidation_group=purchase_data['consolidation_group'],
+            payment_balance=purchase_data['payment_balance'],
+            invoice_date=purchase_data['invoice_date'],
+            invoice_amount=purchase_data['invoice_amount'],
+            items=items,
+            status_history=status_history
+        )
+
+        return PurchaseResponse(data=purchase)
 
     except AuthenticationError:
         raise
@@ -334,10 +606,101 @@ async def get_purchase_by_id(
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+async def _insert_purchase_items(conn, purchase_id: UUID, items_data, unit_error: str) -> List[PurchaseItem]:
+    """
+    Insert all items of a purchase with a single INSERT ... SELECT FROM unnest,
+    validating ingredients and units in the same statement
+
+    Args:
+        unit_error: Detail for a unit mismatch, formatted with expected and received
+
+    Raises:
+        HTTPException: 400 if an ingredient does not exist or its unit does not match
+    """
+    if not items_data:
+        return []
+
+    columns = ([], [], [], [], [], [], [], [])
+    for item_data in items_data:
+        # Calculate total_cost only if unit_cost is provided (not for quotations)
+        total_cost = None
+        if item_data.unit_cost is not None:
+            total_cost = item_data.total_cost or (item_data.quantity * item_data.unit_cost)
+
+        values = (
+            item_data.ingredient_id,
+            item_data.quantity,
+            item_data.unit,
+            item_data.unit_cost,
+            total_cost,
+            item_data.expiry_date,
+            item_data.batch_number,
+            item_data.notes
+        )
+        for column, value in zip(columns, values):
+            column.append(value)
+
+    rows = await conn.fetch(_INSERT_PURCHASE_ITEMS, purchase_id, *columns)
+    if len(rows) != len(items_data):
+        # Some item was rejected by the join; look up which one for the error detail.
+        # Raising rolls back the rows that were inserted
+        ingredients_meta = await get_ingredients_meta(
+            conn, [item_data.ingredient_id for item_data in items_data]
+        )
+        for item_data in items_data:
+            if item_data.ingredient_id not in ingredients_meta:
+                raise HTTPException(status_code=400, detail=f"Ingrediente no encontrado: {item_data.ingredient_id}")
+
+            expected_unit, _ = ingredients_meta[item_data.ingredient_id]
+            if item_data.unit != expected_unit:
+                raise HTTPException(
+                    status_code=400,
+                    detail=unit_error.format(expected=expected_unit, received=item_data.unit)
+                )
+
+        raise HTTPException(status_code=400, detail="Unidad incorrecta en los items de la compra")
+
+    return [PurchaseItem.model_construct(**row) for row in rows]
+
+async def _send_quotation(purchase_id: UUID, tenant_id: UUID):
+    """
+    Send the quotation request email to the supplier
+    Runs as a background task, so errors are logged instead of raised
+    """
+    try:
+        async with get_db_connection() as conn:
+            quotation = await conn.fetchrow(_SELECT_QUOTATION_EMAIL_DATA, purchase_id, tenant_id)
+
+            if not quotation or not quotation['supplier_email']:
+                return
+
+            items = await conn.fetch(_SELECT_QUOTATION_EMAIL_ITEMS, purchase_id)
+
+        await send_quotation_email(
+            supplier_email=quotation['supplier_email'],
+            supplier_name=quotation['supplier_name'],
+            purchase_number=quotation['purchase_number'],
+            purchase_date=quotation['purchase_date'],
+            delivery_date=quotation['delivery_date'],
+            items=[dict(item) for item in items],
+            notes=quotation['notes'],
+            supplier_token=str(quotation['access_token']) if quotation['access_token'] else None,
+            tenant_site=quotation['tenant_site'],
+            payment_type=quotation['payment_type'],
+            payment_terms=quotation['payment_terms'],
+            credit_days=quotation['credit_days'],
+            requires_advance_payment=quotation['requires_advance_payment'],
+            consolidation_group=quotation['consolidation_group']
+        )
+    except Exception as e:
+        logger.error(f"Error sending quotation email for purchase {purchase_id}: {e}")
+
+@invalidates_cache("purchases")
 async def create_purchase(
     request: Request,
     response: Response,
-    purchase_data: PurchaseCreate
+    purchase_data: PurchaseCreate,
+    background_tasks: BackgroundTasks
 ) -> PurchaseResponse:
     """
     Create a new purchase with tenant isolation
@@ -352,80 +715,18 @@ async def create_purchase(
 
         async with get_db_connection() as conn:
             async with conn.transaction():
-                # Generate purchase number automatically: WR-YYYY-NNNN
+                # Purchase number WR-YYYY-NNNN is allocated by the INSERT itself
                 from datetime import datetime
                 current_year = datetime.now().year
 
-                # Get the last purchase number for this year and tenant
-                last_purchase = await conn.fetchrow("""
-                    SELECT purchase_number
-                    FROM tenant_purchases
-                    WHERE tenant_id = $1
-                        AND purchase_number LIKE $2
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                """, tenant_id, f'WR-{current_year}-%')
-
-                # Extract sequence number and increment
-                if last_purchase and last_purchase['purchase_number']:
-                    # Extract NNNN from WR-YYYY-NNNN
-                    last_number = int(last_purchase['purchase_number'].split('-')[-1])
-                    next_number = last_number + 1
-                else:
-                    next_number = 1
-
-                # Generate new purchase number: WR-YYYY-NNNN
-                purchase_number = f"WR-{current_year}-{next_number:04d}"
-
                 # Use invoice number from request (user entered manually)
                 invoice_number = purchase_data.invoice_number
 
                 # Insert new purchase with payment fields
-                new_purchase = await conn.fetchrow("""
-                    INSERT INTO tenant_purchases (
-                        tenant_id,
-                        supplier_id,
-                        purchase_number,
-                        purchase_date,
-                        delivery_date,
-                        total_amount,
-                        tax_amount,
-                        status,
-                        invoice_number,
-                        notes,
-                        created_by,
-                        payment_type,
-                        payment_terms,
-                        credit_days,
-                        requires_advance_payment,
-                        consolidation_group,
-                        payment_balance
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17)
-                    RETURNING
-                        id,
-                        tenant_id,
-                        supplier_id,
-                        purchase_number,
-                        purchase_date,
-                        delivery_date,
-                        total_amount,
-                        tax_amount,
-                        status,
-                        invoice_number,
-                        notes,
-                        created_by,
-                        created_at,
-                        updated_at,
-                        payment_type,
-                        payment_terms,
-                        credit_days,
-                        requires_advance_payment,
-                        consolidation_group,
-                        payment_balance
-                """,
+                new_purchase = await conn.fetchrow(_INSERT_PURCHASE,
                     tenant_id,
                     purchase_data.supplier_id,
-                    purchase_number,  # Auto-generated
+                    current_year,  # Purchase number year
                     purchase_data.purchase_date,
                     purchase_data.delivery_date,
                     purchase_data.total_amount,
@@ -444,65 +745,12 @@ async def create_purchase(
 
                 purchase_id = new_purchase['id']
 
-                # Insert purchase items
-                items = []
-                for item_data in purchase_data.items:
-                    # Validate ingredient exists and unit matches (frontend should convert to base unit)
-                    ingredient = await conn.fetchrow("""
-                        SELECT unit FROM ingredients WHERE id = $1
-                    """, item_data.ingredient_id)
-
-                    if not ingredient:
-                        raise HTTPException(status_code=400, detail=f"Ingrediente no encontrado: {item_data.ingredient_id}")
-
-                    # Verify unit matches ingredient's base unit (data should come converted from frontend)
-                    if item_data.unit != ingredient['unit']:
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Error de conversión: se esperaba '{ingredient['unit']}' pero se recibió '{item_data.unit}'"
-                        )
-
-                    # Calculate total_cost only if unit_cost is provided (not for quotations)
-                    total_cost = None
-                    if item_data.unit_cost is not None:
-                        total_cost = item_data.total_cost or (item_data.quantity * item_data.unit_cost)
-
-                    new_item = await conn.fetchrow("""
-                        INSERT INTO tenant_purchase_items (
-                            purchase_id,
-                            ingredient_id,
-                            quantity,
-                            unit,
-                            unit_cost,
-                            total_cost,
-                            expiry_date,
-                            batch_number,
-                            notes
-                        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                        RETURNING
-                            id,
-                            purchase_id,
-                            ingredient_id,
-                            quantity,
-                            unit,
-                            unit_cost,
-                            total_cost,
-                            expiry_date,
-                            batch_number,
-                            notes,
-                            created_at
-                    """,
-                        purchase_id,
-                        item_data.ingredient_id,
-                        item_data.quantity,
-                        item_data.unit,
-                        item_data.unit_cost,
-                        total_cost,
-                        item_data.expiry_date,
-                        item_data.batch_number,
-                        item_data.notes
-                    )
-                    items.append(PurchaseItem(**new_item))
+                # Insert purchase items; units must match the ingredient's base unit
+                # (data should come converted from frontend)
+                items = await _insert_purchase_items(
+                    conn, purchase_id, purchase_data.items,
+                    "Error de conversión: se esperaba '{expected}' pero se recibió '{received}'"
+                )
 
                 purchase = Purchase(
                     id=new_purchase['id'],
@@ -522,63 +770,20 @@ async def create_purchase(
                     items=items
                 )
 
-                # If this is a quotation, send email to supplier
-                if new_purchase['status'] == 'quotation':
-                    try:
-                        # Fetch tenant site information from tenant_sites
-                        tenant_info = await conn.fetchrow("""
-                            SELECT site FROM tenant_sites WHERE tenant_id = $1 AND is_active = true LIMIT 1
-                        """, tenant_id)
-
-                        # Fetch supplier information including access token
-                        supplier = await conn.fetchrow("""
-                            SELECT name, email, access_token
-                            FROM tenant_suppliers
-                            WHERE id = $1 AND tenant_id = $2
-                        """, purchase_data.supplier_id, tenant_id)
-
-                        if supplier and supplier['email']:
-                            # Fetch ingredient names for email
-                            items_with_names = []
-                            for item in items:
-                                ingredient = await conn.fetchrow("""
-                                    SELECT name FROM ingredients WHERE id = $1
-                                """, item.ingredient_id)
-                                items_with_names.append({
-                                    'ingredient_name': ingredient['name'] if ingredient else 'Producto',
-                                    'quantity': item.quantity,
-                                    'unit': item.unit
-                                })
-
-                            # Send quotation email with portal link
-                            await send_quotation_email(
-                                supplier_email=supplier['email'],
-                                supplier_name=supplier['name'],
-                                purchase_number=new_purchase['purchase_number'],
-                                purchase_date=new_purchase['purchase_date'],
-                                delivery_date=new_purchase['delivery_date'],
-                                items=items_with_names,
-                                notes=purchase_data.notes,
-                                supplier_token=str(supplier['access_token']) if supplier['access_token'] else None,
-                                tenant_site=tenant_info['site'] if tenant_info else None,
-                                payment_type=new_purchase['payment_type'],
-                                payment_terms=new_purchase['payment_terms'],
-                                credit_days=new_purchase['credit_days'],
-                                requires_advance_payment=new_purchase['requires_advance_payment'],
-                                consolidation_group=new_purchase['consolidation_group']
-                            )
-                    except Exception as email_error:
-                        # Log error but don't fail the purchase creation
-                        pass
-
-                return PurchaseResponse(data=purchase)
+                result = PurchaseResponse(data=purchase)
+
+        # Email the supplier once the purchase is committed, after the response is sent
+        if new_purchase['status'] == 'quotation':
+            background_tasks.add_task(_send_quotation, purchase_id, tenant_id)
+
+        return result
 
     except AuthenticationError:
         raise
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        print(f"[DEBUG] Error creating purchase: {str(e)}")
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        logger.exception(f"Error creating purchase: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 async def update_purchase(
@@ -597,94 +802,74 @@ async def update_purchase(
         if not tenant_id:
             raise AuthenticationError("Tenant ID is required")
 
+        fields = frozenset(purchase_data.model_fields_set - {'items'})
+        if not fields and purchase_data.items is None:
+            # Nothing to change: return the purchase as it is, without rewriting
+            # the row, bumping updated_at or invalidating the cached lists
+            return await get_purchase_by_id(request, response, purchase_id)
+
         async with get_db_connection() as conn:
             async with conn.transaction():
-                # Verify purchase exists and belongs to tenant
-                existing_purchase = await conn.fetchrow("""
-                    SELECT id FROM tenant_purchases
-                    WHERE id = $1 AND tenant_id = $2
-                """, purchase_id, tenant_id)
+                update_query, columns = _build_update_purchase_query(fields)
+                params = [purchase_id, tenant_id]
+                params.extend(getattr(purchase_data, column) for column in columns)
+
+                purchase_row = await conn.fetchrow(update_query, *params)
 
-                if not existing_purchase:
+                if not purchase_row:
                     raise HTTPException(status_code=404, detail="Purchase not found")
 
-                # Build update query dynamically
-                update_fields = []
-                params = [purchase_id, tenant_id]
-                param_count = 3
+                # Update items if provided
+                if purchase_data.items is not None:
+                    # Delete existing items
+                    await conn.execute(_DELETE_PURCHASE_ITEMS, purchase_id)
 
-                for field, value in purchase_data.dict(exclude_unset=True, exclude={'items'}).items():
-                    update_fields.append(f"{field} = ${param_count}")
-                    params.append(value)
-                    param_count += 1
+                    # Insert new items, validating units against the ingredients
+                    items = await _insert_purchase_items(
+                        conn, purchase_id, purchase_data.items,
+                        "Unidad incorrecta. El ingrediente usa '{expected}' pero se envió '{received}'"
+                    )
+                else:
+                    items_data = await conn.fetch(_SELECT_ITEMS_BY_PURCHASE, purchase_id)
+                    items = [PurchaseItem(**item) for item in items_data]
 
-                if update_fields:
-                    # Add updated_at
-                    update_fields.append(f"updated_at = NOW()")
+                # The response keeps the full detail, history included
+                status_history = await conn.fetchval(_SELECT_STATUS_HISTORY_JSON, purchase_id)
 
-                    update_query = f"""
-                        UPDATE tenant_purchases
-                        SET {', '.join(update_fields)}
-                        WHERE id = $1 AND tenant_id = $2
-                    """
+                purchase = Purchase(
+                    id=purchase_row['id'],
+                    tenant_id=purchase_row['tenant_id'],
+                    supplier_id=purchase_row['supplier_id'],
+                    supplier_name=purchase_row['supplier_name'],
+                    purchase_number=purchase_row['purchase_number'],
+                    purchase_date=purchase_row['purchase_date'],
+                    delivery_date=purchase_row['delivery_date'],
+                    total_amount=purchase_row['total_amount'],
+                    tax_amount=purchase_row['tax_amount'],
+                    status=purchase_row['status'],
+                    invoice_number=purchase_row['invoice_number'],
+                    notes=purchase_row['notes'],
+                    created_by=purchase_row['created_by'],
+                    created_at=purchase_row['created_at'],
+                    updated_at=purchase_row['updated_at'],
+                    payment_type=purchase_row['payment_type'],
+                    payment_terms=purchase_row['payment_terms'],
+                    credit_days=purchase_row['credit_days'],
+                    payment_due_date=purchase_row['payment_due_date'],
+                    requires_advance_payment=purchase_row['requires_advance_payment'],
+                    consolidation_group=purchase_row['consolidation_group'],
+                    payment_balance=purchase_row['payment_balance'],
+                    invoice_date=purchase_row['invoice_date'],
+                    invoice_amount=purchase_row['invoice_amount'],
+                    items=items,
+                    status_history=status_history
+                )
 
-                    await conn.execute(update_query, *params)
+                result = PurchaseResponse(data=purchase)
 
-                # Update items if provided
-                if purchase_data.items is not None:
-                    # Delete existing items
-                    await conn.execute("""
-                        DELETE FROM tenant_purchase_items
-                        WHERE purchase_id = $1
-                    """, purchase_id)
-
-                    # Insert new items
-                    for item_data in purchase_data.items:
-                        # Validate unit matches ingredient's unit
-                        ingredient = await conn.fetchrow("""
-                            SELECT unit FROM ingredients WHERE id = $1
-                        """, item_data.ingredient_id)
-
-                        if not ingredient:
-                            raise HTTPException(status_code=400, detail=f"Ingrediente no encontrado: {item_data.ingredient_id}")
-
-                        if item_data.unit != ingredient['unit']:
-                            raise HTTPException(
-                                status_code=400,
-                                detail=f"Unidad incorrecta. El ingrediente usa '{ingredient['unit']}' pero se envió '{item_data.unit}'"
-                            )
-
-                        # Calculate total_cost only if unit_cost is provided (not for quotations)
-                        total_cost = None
-                        if item_data.unit_cost is not None:
-                            total_cost = item_data.total_cost or (item_data.quantity * item_data.unit_cost)
-
-                        await conn.execute("""
-                            INSERT INTO tenant_purchase_items (
-                                purchase_id,
-                                ingredient_id,
-                                quantity,
-                                unit,
-                                unit_cost,
-                                total_cost,
-                                expiry_date,
-                                batch_number,
-                                notes
-                            ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                        """,
-                            purchase_id,
-                            item_data.ingredient_id,
-                            item_data.quantity,
-                            item_data.unit,
-                            item_data.unit_cost,
-                            total_cost,
-                            item_data.expiry_date,
-                            item_data.batch_number,
-                            item_data.notes
-                        )
-
-                # Fetch updated purchase
-                return await get_purchase_by_id(request, response, purchase_id)
+        # Invalidate once the update has committed
+        await invalidate_tenant_cache("purchases", tenant_id)
+        return result
 
     except AuthenticationError:
         raise
@@ -0,0 +1,165 @@
+"""
+Reference Data Cache
+In-process TTL caches for slow-changing lookups used on purchase hot paths
+(supplier names, ingredient unit/name). Supplier changes are broadcast with
+NOTIFY so every worker drops its copy; ingredients are only written by other
+apps and rely on the TTL.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Set, Tuple
+from uuid import UUID
+import asyncpg
+from cachetools import TTLCache
+from app.config import settings
+from app.core.cache import invalidate_tenant_cache
+
+logger = logging.getLogger(__name__)
+
+_REFERENCE_TTL_SECONDS = 60
+_MISSING = object()
+
+SUPPLIER_CHANGES_CHANNEL = 'supplier_changes'
+_LISTENER_RETRY_SECONDS = 5
+
+# ingredient_id -> (unit, name)
+_ingredient_meta: TTLCache = TTLCache(maxsize=4096, ttl=_REFERENCE_TTL_SECONDS)
+
+# supplier_id -> name; only used while this worker is listening for supplier
+# changes, since otherwise nothing would drop renamed or deleted suppliers
+_supplier_names: TTLCache = TTLCache(maxsize=4096, ttl=_REFERENCE_TTL_SECONDS)
+_listening = False
+
+_listener_task: Optional[asyncio.Task] = None
+_invalidation_tasks: Set[asyncio.Task] = set()
+
+_SELECT_INGREDIENTS_META = """
+    SELECT id, unit, name
+    FROM ingredients
+    WHERE id = ANY($1::uuid[])
+"""
+
+_SELECT_SUPPLIER_NAMES = """
+    SELECT id, name
+    FROM tenant_suppliers
+    WHERE id = ANY($1::uuid[])
+"""
+
+_NOTIFY_SUPPLIER_CHANGED = """
+    SELECT pg_notify($1, $2)
+"""
+
+async def get_ingredients_meta(conn, ingredient_ids: Iterable[UUID]) -> Dict[UUID, Tuple[str, str]]:
+    """
+    Get (unit, name) for several ingredients, querying only the cache misses
+
+    Returns:
+        Metadata by ingredient id; unknown ingredients are absent
+    """
+    result = {}
+    missing = []
+    for ingredient_id in set(ingredient_ids):
+        meta = _ingredient_meta.get(ingredient_id)
+        if meta is None:
+            missing.append(ingredient_id)
+        else:
+            result[ingredient_id] = meta
+
+    if missing:
+        rows = await conn.fetch(_SELECT_INGREDIENTS_META, missing)
+        for row in rows:
+            meta = (row['unit'], row['name'])
+            _ingredient_meta[row['id']] = meta
+            result[row['id']] = meta
+
+    return result
+
+async def get_supplier_names(conn, supplier_ids: Iterable[Optional[UUID]]) -> Dict[UUID, str]:
+    """
+    Get names for several suppliers, querying only the cache misses
+
+    Returns:
+        Name by supplier id; unknown suppliers are absent
+    """
+    result = {}
+    missing = []
+    for supplier_id in set(supplier_ids):
+        if supplier_id is None:
+            continue
+        name = _supplier_names.get(supplier_id, _MISSING) if _listening else _MISSING
+        if name is _MISSING:
+            missing.append(supplier_id)
+        else:
+            result[supplier_id] = name
+
+    if missing:
+        rows = await conn.fetch(_SELECT_SUPPLIER_NAMES, missing)
+        for row in rows:
+            if _listening:
+                _supplier_names[row['id']] = row['name']
+            result[row['id']] = row['name']
+
+    return result
+
+async def notify_supplier_changed(conn, supplier_id: UUID, tenant_id: UUID) -> None:
+    """
+    Announce a supplier update or delete to every worker
+    Sent inside the caller's transaction, so it is delivered only on commit
+    """
+    await conn.execute(_NOTIFY_SUPPLIER_CHANGED, SUPPLIER_CHANGES_CHANNEL, f"{supplier_id}:{tenant_id}")
+
+def _on_supplier_changed(connection, pid, channel, payload: str) -> None:
+    supplier_id, _, tenant_id = payload.partition(':')
+    _supplier_names.pop(UUID(supplier_id), None)
+
+    # Every worker bumps the purchases list version after dropping its own copy,
+    # so no worker can cache a list with the old name under the latest version
+    task = asyncio.create_task(invalidate_tenant_cache("purchases", tenant_id))
+    _invalidation_tasks.add(task)
+    task.add_done_callback(_invalidation_tasks.discard)
+
+async def _listen_supplier_changes() -> None:
+    """Keep a dedicated connection listening for supplier changes, reconnecting on loss"""
+    global _listening
+    while True:
+        try:
+            # LISTEN needs a session of its own, so it cannot use a pooled connection
+            conn = await asyncpg.connect(**settings.db_connection_params)
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning(f"Supplier change listener could not connect: {e}")
+            await asyncio.sleep(_LISTENER_RETRY_SECONDS)
+            continue
+
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda _: closed.set())
+        try:
+            await conn.add_listener(SUPPLIER_CHANGES_CHANNEL, _on_supplier_changed)
+            _listening = True
+            await closed.wait()
+            logger.warning("Supplier change listener connection lost, reconnecting")
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning(f"Supplier change listener failed: {e}")
+        finally:
+            # Changes made while disconnected are not replayed
+            _listening = False
+            _supplier_names.clear()
+            if not conn.is_closed():
+                await conn.close()
+
+        await asyncio.sleep(_LISTENER_RETRY_SECONDS)
+
+def start_supplier_listener() -> None:
+    """Start listening for supplier changes; call once per process at startup"""
+    global _listener_task
+    if _listener_task is None:
+        _listener_task = asyncio.create_task(_listen_supplier_changes())
+
+async def stop_supplier_listener() -> None:
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
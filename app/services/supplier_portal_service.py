@@ -2,12 +2,312 @@
 Supplier Portal Service
 Allows suppliers to access their purchases and update statuses using a unique token
 """
-from typing import Optional, Dict, Any, List
+import asyncio
+import logging
+from datetime import date
+from typing import Optional, Dict, Any, List, Tuple
 from uuid import UUID
 from fastapi import HTTPException, UploadFile
 from app.database import get_db_connection
-from datetime import datetime
-from app.services.aws_s3_service import AWSS3Service
+from app.services.aws_s3_service import AWSS3Service, get_s3_service
+from app.models.supplier import ItemPriceUpdate
+from app.core.cache import invalidate_tenant_cache
+from app.utils.dates import parse_iso_datetime
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round-trip when streaming a supplier's purchases
+_PORTAL_CURSOR_PREFETCH = 200
+
+# Max portal requests uploading attachments to S3/R2 at the same time
+_UPLOAD_CONCURRENCY = 20
+_upload_semaphore: Optional[asyncio.Semaphore] = None
+
+_SELECT_SUPPLIER_BY_TOKEN = """
+    SELECT
+        id,
+        tenant_id,
+        name,
+        email,
+        phone,
+        address,
+        tax_id,
+        payment_terms
+    FROM tenant_suppliers
+    WHERE access_token = $1
+"""
+
+_SELECT_SUPPLIER_PURCHASE = """
+    SELECT
+        s.id as supplier_id,
+        s.tenant_id,
+        p.id,
+        p.status,
+        p.created_by
+    FROM tenant_suppliers s
+    LEFT JOIN tenant_purchases p ON p.id = $2 AND p.supplier_id = s.id
+    WHERE s.access_token = $1
+"""
+
+# Amounts are cast to float8 so rows can be serialized without per-value conversions
+_SELECT_SUPPLIER_PURCHASES_BASE = """
+    SELECT
+        p.id,
+        p.purchase_number,
+        p.purchase_date,
+        p.delivery_date,
+        p.total_amount::float8 as total_amount,
+        p.tax_amount::float8 as tax_amount,
+        p.status,
+        p.notes,
+        p.created_at,
+        p.updated_at,
+        p.payment_type,
+        p.payment_terms,
+        p.credit_days,
+        p.payment_due_date,
+        p.requires_advance_payment,
+        p.consolidation_group,
+        p.payment_balance::float8 as payment_balance,
+        itm.items
+    FROM tenant_purchases p
+    -- Items are built as JSON by PostgreSQL in the portal response shape
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(json_agg(json_build_object(
+            'id', i.id::text,
+            'ingredient_id', i.ingredient_id::text,
+            'ingredient_name', ing.name,
+            'quantity', i.quantity::float8,
+            'unit', i.unit,
+            'unit_cost', NULLIF(i.unit_cost, 0)::float8,
+            'total_cost', NULLIF(i.total_cost, 0)::float8,
+            'notes', i.notes
+        )), '[]'::json) AS items
+        FROM tenant_purchase_items i
+        LEFT JOIN ingredients ing ON i.ingredient_id = ing.id
+        WHERE i.purchase_id = p.id
+    ) itm ON true
+    WHERE p.supplier_id = $1
+"""
+
+# One constant text per filter shape so each is prepared once per connection
+_SELECT_SUPPLIER_PURCHASES = _SELECT_SUPPLIER_PURCHASES_BASE + """
+    ORDER BY p.created_at DESC
+"""
+
+_SELECT_SUPPLIER_PURCHASES_BY_STATUS = _SELECT_SUPPLIER_PURCHASES_BASE + """
+    AND p.status = $2
+    ORDER BY p.created_at DESC
+"""
+
+# Requested purchases of the supplier with their latest 'invoiced' transition
+# (id and document type); the supplier row is returned even if none match
+_SELECT_SUPPLIER_REMISIONES = """
+    SELECT
+        s.tenant_id,
+        p.id,
+        p.purchase_number,
+        p.created_by,
+        psh.id as history_id,
+        psh.metadata->>'document_type' as document_type
+    FROM tenant_suppliers s
+    LEFT JOIN tenant_purchases p ON p.id = ANY($2::uuid[]) AND p.supplier_id = s.id
+    LEFT JOIN LATERAL (
+        SELECT id, metadata
+        FROM purchase_status_history
+        WHERE purchase_id = p.id
+        AND to_status = 'invoiced'
+        ORDER BY changed_at DESC
+        LIMIT 1
+    ) psh ON true
+    WHERE s.access_token = $1
+"""
+
+# Columns are already in the response shape (text ids, float amounts, response
+# key order); dates are encoded by orjson in the router
+_SELECT_SUPPLIER_INVOICES = """
+    SELECT
+        p.id::text as id,
+        p.purchase_number,
+        p.purchase_date,
+        p.invoice_number,
+        p.invoice_date,
+        NULLIF(p.invoice_amount, 0)::float8 as invoice_amount,
+        COALESCE(p.tax_amount, 0)::float8 as tax_amount,
+        COALESCE(p.total_amount, 0)::float8 as total_amount,
+        p.status,
+        p.payment_type,
+        p.payment_due_date,
+        p.notes,
+        p.supplier_id::text as supplier_id,
+        s.name as supplier_name,
+        psh.metadata->>'document_type' as document_type,
+        psh.metadata->>'numero_factura_legal' as legal_invoice_number,
+        psh.metadata->>'fecha_factura_legal' as legal_invoice_date
+    FROM tenant_purchases p
+    LEFT JOIN tenant_suppliers s ON p.supplier_id = s.id
+    LEFT JOIN LATERAL (
+        SELECT metadata
+        FROM purchase_status_history
+        WHERE purchase_id = p.id
+        AND to_status = 'invoiced'
+        ORDER BY changed_at DESC
+        LIMIT 1
+    ) psh ON true
+    WHERE p.supplier_id = $1
+    AND p.status IN ('invoiced', 'shipped', 'received', 'paid')
+    AND ($2::text IS NULL OR psh.metadata->>'document_type' = $2)
+    AND ($3::date IS NULL OR p.invoice_date >= $3)
+    AND ($4::date IS NULL OR p.invoice_date <= $4)
+    ORDER BY p.invoice_date DESC
+"""
+
+_INSERT_PURCHASE_ATTACHMENT = """
+    INSERT INTO purchase_attachments (
+        tenant_id,
+        purchase_id,
+        path,
+        file_name,
+        file_size,
+        mime_type,
+        attachment_type,
+        description,
+        uploaded_by,
+        s3_key,
+        s3_url
+    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+"""
+
+_INSERT_LEGAL_INVOICE_ATTACHMENT = """
+    INSERT INTO purchase_attachments (
+        purchase_id,
+        tenant_id,
+        path,
+        file_name,
+        file_size,
+        s3_key,
+        mime_type,
+        attachment_type,
+        related_status,
+        description,
+        uploaded_by,
+        uploaded_at
+    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, NOW())
+"""
+
+_UPDATE_LEGAL_INVOICE_HISTORY = """
+    UPDATE purchase_status_history
+    SET metadata = COALESCE(metadata, '{}'::jsonb) || jsonb_build_object(
+        'numero_factura_legal', $2::text,
+        'fecha_factura_legal', $3::text
+    )
+    WHERE id = ANY($1::uuid[])
+"""
+
+async def _upload_attachments(
+    s3_service: AWSS3Service,
+    files: List[UploadFile]
+) -> List[Tuple[UploadFile, str, Optional[str]]]:
+    """
+    Upload files to S3/R2 concurrently and presign their URLs
+
+    Returns:
+        (file, s3_key, url) for each uploaded file; failed uploads are skipped
+    """
+    async def upload_one(file: UploadFile):
+        s3_key = await s3_service.upload_file(
+            file_content=file.file,
+            filename=file.filename,
+            folder='purchases/attachments',
+            content_type=file.content_type
+        )
+        if not s3_key:
+            return None
+        file_url = await s3_service.get_presigned_url(s3_key, expiration=3600)
+        return file, s3_key, file_url
+
+    results = await asyncio.gather(*(upload_one(file) for file in files), return_exceptions=True)
+
+    uploaded = []
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
+            # Continue with other files even if one fails
+            logger.warning(f"Failed to upload file {file.filename}: {str(result)}")
+        elif result is not None:
+            uploaded.append(result)
+    return uploaded
+
+def _get_upload_semaphore() -> asyncio.Semaphore:
+    """Create the upload semaphore lazily so it binds to the running event loop"""
+    global _upload_semaphore
+    if _upload_semaphore is None:
+        _upload_semaphore = asyncio.Semaphore(_UPLOAD_CONCURRENCY)
+    return _upload_semaphore
+
+async def _save_attachments(
+    purchase: Dict[str, Any],
+    purchase_id: UUID,
+    files: List[UploadFile],
+    attachment_type: str,
+    description: str
+) -> None:
+    """
+    Upload portal attachments and record them for a purchase.
+    Runs after the status change has been committed, so no pooled connection is
+    held while waiting on S3/R2
+    """
+    async with _get_upload_semaphore():
+        uploaded = await _upload_attachments(get_s3_service(), files)
+
+    attachment_rows = [
+        (
+            purchase['tenant_id'],
+            purchase_id,
+            s3_key,  # path (required)
+            file.filename,
+            file.size or 0,
+            file.content_type or 'application/octet-stream',
+            attachment_type,
+            description,
+            purchase['created_by'],  # Use original creator as uploader
+            s3_key,
+            file_url
+        )
+        for file, s3_key, file_url in uploaded
+    ]
+    if not attachment_rows:
+        return
+
+    async with get_db_connection() as conn:
+        await conn.executemany(_INSERT_PURCHASE_ATTACHMENT, attachment_rows)
+
+async def _resolve_supplier(conn, token_uuid: UUID) -> Optional[Dict[str, Any]]:
+    """
+    Get the supplier for a portal token. Always read from the database, so a
+    deleted supplier's token stops working on every worker at once
+
+    Returns:
+        Supplier row as a dict, or None if the token is unknown
+    """
+    row = await conn.fetchrow(_SELECT_SUPPLIER_BY_TOKEN, token_uuid)
+    return dict(row) if row else None
+
+async def _get_supplier_purchase(conn, token_uuid: UUID, purchase_id: UUID):
+    """
+    Verify the token and that the purchase belongs to its supplier in one query
+
+    Raises:
+        HTTPException: 404 if the token is invalid or the purchase is not the supplier's
+    """
+    purchase = await conn.fetchrow(_SELECT_SUPPLIER_PURCHASE, token_uuid, purchase_id)
+
+    if not purchase:
+        raise HTTPException(status_code=404, detail="Token inválido")
+
+    if purchase['id'] is None:
+        raise HTTPException(status_code=404, detail="Compra no encontrada")
+
+    return purchase
 
 async def verify_supplier_token(token: str) -> Dict[str, Any]:
     """
@@ -23,41 +323,30 @@ async def verify_supplier_token(token: str) -> Dict[str, Any]:
         HTTPException: If token is invalid
     """
     try:
-        async with get_db_connection() as conn:
-            supplier = await conn.fetchrow("""
-                SELECT
-                    id,
-                    tenant_id,
-                    name,
-                    email,
-                    phone,
-                    address,
-                    tax_id,
-                    payment_terms,
-                    access_token
-                FROM tenant_suppliers
-                WHERE access_token = $1
-            """, UUID(token))
-
-            if not supplier:
-                raise HTTPException(
-                    status_code=404,
-                    detail="Token inválido o proveedor no encontrado"
-                )
-
-            return {
-                "success": True,
-                "supplier": {
-                    "id": str(supplier['id']),
-                    "tenant_id": str(supplier['tenant_id']),
-                    "name": supplier['name'],
-                    "email": supplier['email'],
-                    "phone": supplier['phone'],
-                    "address": supplier['address'],
-                    "tax_id": supplier['tax_id'],
-                    "payment_terms": supplier['payment_terms']
-                }
+        token_uuid = UUID(token)
+
+        async with get_db_connection(readonly=True) as conn:
+            supplier = await _resolve_supplier(conn, token_uuid)
+
+        if not supplier:
+            raise HTTPException(
+                status_code=404,
+                detail="Token inválido o proveedor no encontrado"
+            )
+
+        return {
+            "success": True,
+            "supplier": {
+                "id": str(supplier['id']),
+                "tenant_id": str(supplier['tenant_id']),
+                "name": supplier['name'],
+                "email": supplier['email'],
+                "phone": supplier['phone'],
+                "address": supplier['address'],
+                "tax_id": supplier['tax_id'],
+                "payment_terms": supplier['payment_terms']
             }
+        }
     except ValueError:
         raise HTTPException(status_code=400, detail="Token inválido")
     except HTTPException:
@@ -77,76 +366,34 @@ async def get_supplier_purchases(token: str, status_filter: Optional[str] = None
         Dict with list of purchases
     """
     try:
-        async with get_db_connection() as conn:
+        # Reject malformed tokens before taking a pooled connection
+        token_uuid = UUID(token)
+
+        async with get_db_connection(readonly=True) as conn:
             # First verify the token and get supplier_id
-            supplier = await conn.fetchrow("""
-                SELECT id, tenant_id
-                FROM tenant_suppliers
-                WHERE access_token = $1
-            """, UUID(token))
+            supplier = await _resolve_supplier(conn, token_uuid)
 
             if not supplier:
                 raise HTTPException(status_code=404, detail="Token inválido")
 
-            # Build query
-            query = """
-                SELECT
-                    p.id,
-                    p.purchase_number,
-                    p.purchase_date,
-                    p.delivery_date,
-                    p.total_amount,
-                    p.tax_amount,
-                    p.status,
-                    p.notes,
-                    p.created_at,
-                    p.updated_at,
-                    p.payment_type,
-                    p.payment_terms,
-                    p.credit_days,
-                    p.payment_due_date,
-                    p.requires_advance_payment,
-                    p.consolidation_group,
-                    p.payment_balance
-                FROM tenant_purchases p
-                WHERE p.supplier_id = $1
-            """
-
-            params = [supplier['id']]
-
             if status_filter:
-                query += " AND p.status = $2"
-                params.append(status_filter)
-
-            query += " ORDER BY p.created_at DESC"
-
-            purchases = await conn.fetch(query, *params)
-
-            # Fetch items for each purchase
+                query = _SELECT_SUPPLIER_PURCHASES_BY_STATUS
+                params = [supplier['id'], status_filter]
+            else:
+                query = _SELECT_SUPPLIER_PURCHASES
+                params = [supplier['id']]
+
+            # Stream purchases and serialize each row as it arrives instead of
+            # buffering every record; items arrive already decoded from JSON
             result_purchases = []
-            for purchase in purchases:
-                items = await conn.fetch("""
-                    SELECT
-                        i.id,
-                        i.ingredient_id,
-                        ing.name as ingredient_name,
-                        i.quantity,
-                        i.unit,
-                        i.unit_cost,
-                        i.total_cost,
-                        i.notes
-                    FROM tenant_purchase_items i
-                    LEFT JOIN ingredients ing ON i.ingredient_id = ing.id
-                    WHERE i.purchase_id = $1
-                """, purchase['id'])
-
+            async for purchase in conn.cursor(query, *params, prefetch=_PORTAL_CURSOR_PREFETCH):
                 result_purchases.append({
                     "id": str(purchase['id']),
                     "purchase_number": purchase['purchase_number'],
                     "purchase_date": purchase['purchase_date'].isoformat() if purchase['purchase_date'] else None,
                     "delivery_date": purchase['delivery_date'].isoformat() if purchase['delivery_date'] else None,
-                    "total_amount": float(purchase['total_amount']) if purchase['total_amount'] else 0,
-                    "tax_amount": float(purchase['tax_amount']) if purchase['tax_amount'] else 0,
+                    "total_amount": purchase['total_amount'] or 0,
+                    "tax_amount": purchase['tax_amount'] or 0,
                     "status": purchase['status'],
                     "notes": purchase['notes'],
                     "created_at": purchase['created_at'].isoformat() if purchase['created_at'] else None,
@@ -157,20 +404,8 @@ async def get_supplier_purchases(token: str, status_filter: Optional[str] = None
                     "payment_due_date": purchase['payment_due_date'].isoformat() if purchase['payment_due_date'] else None,
                     "requires_advance_payment": purchase['requires_advance_payment'],
                     "consolidation_group": purchase['consolidation_group'],
-                    "payment_balance": float(purchase['payment_balance']) if purchase['payment_balance'] else None,
-                    "items": [
-                        {
-                            "id": str(item['id']),
-                            "ingredient_id": str(item['ingredient_id']),
-                            "ingredient_name": item['ingredient_name'],
-                            "quantity": float(item['quantity']),
-                            "unit": item['unit'],
-                            "unit_cost": float(item['unit_cost']) if item['unit_cost'] else None,
-                            "total_cost": float(item['total_cost']) if item['total_cost'] else None,
-                            "notes": item['notes']
-                        }
-                        for item in items
-                    ]
+                    "payment_balance": purchase['payment_balance'] or None,
+                    "items": purchase['items']
                 })
 
             return {
@@ -190,7 +425,7 @@ async def get_supplier_purchases(token: str, status_filter: Optional[str] = None
 async def update_purchase_prices(
     token: str,
     purchase_id: UUID,
-    items_prices: List[Dict[str, Any]],
+    items_prices: List[ItemPriceUpdate],
     tax_amount: float,
     notes: Optional[str] = None
 ) -> Dict[str, Any]:
@@ -206,26 +441,16 @@ async def update_purchase_prices(
         notes: Optional notes
     """
     try:
-        async with get_db_connection() as conn:
-            # Verify token and that purchase belongs to this supplier
-            supplier = await conn.fetchrow("""
-                SELECT id, tenant_id
-                FROM tenant_suppliers
-                WHERE access_token = $1
-            """, UUID(token))
+        # Reject malformed tokens before taking a pooled connection
+        token_uuid = UUID(token)
 
-            if not supplier:
-                raise HTTPException(status_code=404, detail="Token inválido")
+        # Without items the purchase total would be overwritten with 0
+        if not items_prices:
+            raise HTTPException(status_code=400, detail="Debe enviar al menos un item con precio")
 
-            # Verify purchase belongs to supplier and is in quotation status
-            purchase = await conn.fetchrow("""
-                SELECT id, status, created_by
-                FROM tenant_purchases
-                WHERE id = $1 AND supplier_id = $2
-            """, purchase_id, supplier['id'])
-
-            if not purchase:
-                raise HTTPException(status_code=404, detail="Compra no encontrada")
+        async with get_db_connection() as conn:
+            # Verify token and that purchase belongs to this supplier
+            purchase = await _get_supplier_purchase(conn, token_uuid, purchase_id)
 
             if purchase['status'] != 'quotation':
                 raise HTTPException(
@@ -234,68 +459,61 @@ async def update_purchase_prices(
                 )
 
             async with conn.transaction():
-                # Update items with prices
-                total_amount = 0
-                for item_price in items_prices:
-                    item_id = UUID(item_price['id'])
-                    unit_cost = float(item_price['unit_cost'])
-
-                    # Get quantity to calculate total
-                    item = await conn.fetchrow("""
-                        SELECT quantity FROM tenant_purchase_items WHERE id = $1
-                    """, item_id)
-
-                    if not item:
-                        continue
-
-                    total_cost = float(item['quantity']) * unit_cost
-                    total_amount += total_cost
-
-                    # Get notes - ensure it's a string or None, not empty string
-                    item_notes = item_price.get('notes')
-                    if not item_notes or item_notes == 'null':
-                        # If no notes, update without the notes field
-                        await conn.execute("""
-                            UPDATE tenant_purchase_items
-                            SET unit_cost = $1,
-                                total_cost = $2
-                            WHERE id = $3
-                        """, unit_cost, total_cost, item_id)
-                    else:
-                        # If notes exist, update with notes
-                        await conn.execute("""
-                            UPDATE tenant_purchase_items
-                            SET unit_cost = $1,
-                                total_cost = $2,
-                                notes = $3
-                            WHERE id = $4
-                        """, unit_cost, total_cost, str(item_notes), item_id)
-
-                # Update purchase with totals and change status to pending
-                if notes:
-                    # If supplier added notes, append them
-                    await conn.execute("""
+                # Price all items in one statement: total_cost is computed from the
+                # stored quantity. Items without notes keep their current notes
+                prices_by_id = {item_price.id: item_price for item_price in items_prices}
+                item_ids = sorted(prices_by_id)
+                unit_costs = [prices_by_id[item_id].unit_cost for item_id in item_ids]
+                item_notes_list = [
+                    None if not prices_by_id[item_id].notes or prices_by_id[item_id].notes == 'null'
+                    else prices_by_id[item_id].notes
+                    for item_id in item_ids
+                ]
+
+                priced_items = await conn.fetch("""
+                    UPDATE tenant_purchase_items t
+                    SET unit_cost = u.unit_cost,
+                        total_cost = t.quantity * u.unit_cost,
+                        notes = COALESCE(u.notes, t.notes)
+                    FROM unnest($1::uuid[], $2::numeric[], $3::text[])
+                        AS u(id, unit_cost, notes)
+                    WHERE t.id = u.id AND t.purchase_id = $4
+                    RETURNING t.total_cost
+                """, item_ids, unit_costs, item_notes_list, purchase_id)
+
+                # Every submitted item must belong to the purchase; raising rolls back
+                # the prices already written
+                if len(priced_items) != len(item_ids):
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Algunos items no pertenecen a esta orden"
+                    )
+
+                total_amount = sum(float(item['total_cost']) for item in priced_items)
+
+                # Update purchase with totals, change status to pending and record
+                # the status history in the same statement; supplier notes, if any,
+                # are appended to the existing ones. The original creator is used as
+                # changed_by since the supplier portal has no user session.
+                # The status is re-checked here: of two concurrent submissions only
+                # the first still finds the purchase in quotation, and the other one
+                # gets no row and is rolled back
+                appended_notes = f"\n[Proveedor]: {notes}" if notes else None
+                history_purchase_id = await conn.fetchval("""
+                    WITH updated AS (
                         UPDATE tenant_purchases
                         SET total_amount = $1,
                             tax_amount = $2,
                             status = 'pending',
-                            notes = CONCAT(COALESCE(notes, ''), '\n[Proveedor]: ', $3),
+                            notes = CASE
+                                WHEN $3::text IS NULL THEN notes
+                                ELSE COALESCE(notes, '') || $3
+                            END,
                             updated_at = NOW()
                         WHERE id = $4
-                    """, total_amount, tax_amount, str(notes), purchase_id)
-                else:
-                    # If no notes, just update amounts and status
-                    await conn.execute("""
-                        UPDATE tenant_purchases
-                        SET total_amount = $1,
-                            tax_amount = $2,
-                            status = 'pending',
-                            updated_at = NOW()
-                        WHERE id = $3
-                    """, total_amount, tax_amount, purchase_id)
-
-                # Record status history (use the original creator as changed_by since supplier portal has no user session)
-                await conn.execute("""
+                        AND status = 'quotation'
+                        RETURNING id, tenant_id
+                    )
                     INSERT INTO purchase_status_history (
                         purchase_id,
                         tenant_id,
@@ -303,15 +521,28 @@ async def update_purchase_prices(
                         to_status,
                         notes,
                         changed_by
-                    ) VALUES ($1, $2, 'quotation', 'pending', $3, $4)
-                """, purchase_id, supplier['tenant_id'],
+                    )
+                    SELECT id, tenant_id, 'quotation', 'pending', $5::text, $6::uuid
+                    FROM updated
+                    RETURNING purchase_id
+                """, total_amount, tax_amount, appended_notes, purchase_id,
                     'Precios completados por proveedor', purchase['created_by'])
 
-                return {
+                if history_purchase_id is None:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Solo se pueden completar precios en cotizaciones"
+                    )
+
+                result = {
                     "success": True,
                     "message": "Precios actualizados correctamente"
                 }
 
+        # Purchase status changed: drop the tenant's cached purchase lists
+        await invalidate_tenant_cache("purchases", purchase['tenant_id'])
+        return result
+
     except ValueError:
         raise HTTPException(status_code=400, detail="Datos inválidos")
     except HTTPException:
@@ -349,26 +580,12 @@ async def invoice_purchase_from_portal(
         notes: Optional notes
     """
     try:
+        # Reject malformed tokens before taking a pooled connection
+        token_uuid = UUID(token)
+
         async with get_db_connection() as conn:
             # Verify token and that purchase belongs to this supplier
-            supplier = await conn.fetchrow("""
-                SELECT id, tenant_id
-                FROM tenant_suppliers
-                WHERE access_token = $1
-            """, UUID(token))
-
-            if not supplier:
-                raise HTTPException(status_code=404, detail="Token inválido")
-
-            # Verify purchase belongs to supplier
-            purchase = await conn.fetchrow("""
-                SELECT id, status, created_by
-                FROM tenant_purchases
-                WHERE id = $1 AND supplier_id = $2
-            """, purchase_id, supplier['id'])
-
-            if not purchase:
-                raise HTTPException(status_code=404, detail="Compra no encontrada")
+            purchase = await _get_supplier_purchase(conn, token_uuid, purchase_id)
 
             # Validate transition (confirmed/preparing/paid -> invoiced)
             # For "contado" payment type: confirmed -> paid -> invoiced
@@ -392,14 +609,14 @@ async def invoice_purchase_from_portal(
 
             # Parse dates
             try:
-                inv_date = datetime.fromisoformat(invoice_date.replace('Z', '+00:00'))
+                inv_date = parse_iso_datetime(invoice_date)
             except ValueError:
                 raise HTTPException(status_code=400, detail="Fecha de factura inválida")
 
             due_date = None
             if payment_due_date:
                 try:
-                    due_date = datetime.fromisoformat(payment_due_date.replace('Z', '+00:00'))
+                    due_date = parse_iso_datetime(payment_due_date)
                 except ValueError:
                     pass
 
@@ -424,7 +641,6 @@ async def invoice_purchase_from_portal(
                     "credit_days": credit_days
                 }
 
-                import json
                 doc_label = "Remisión" if document_type == 'remision' else "Factura"
                 history_notes = notes or f'{doc_label} registrada por proveedor'
 
@@ -438,62 +654,20 @@ async def invoice_purchase_from_portal(
                         notes,
                         changed_by
                     ) VALUES ($1, $2, $3, 'invoiced', $4::jsonb, $5, $6)
-                """, purchase_id, supplier['tenant_id'], purchase['status'],
-                    json.dumps(metadata), history_notes, purchase['created_by'])
-
-                # Upload attachments if provided
-                if files:
-                    s3_service = AWSS3Service()
-                    for file in files:
-                        try:
-                            # Upload file to S3/R2
-                            s3_key = await s3_service.upload_file(
-                                file_content=file.file,
-                                filename=file.filename,
-                                folder='purchases/attachments',
-                                content_type=file.content_type
-                            )
-
-                            if s3_key:
-                                # Generate presigned URL
-                                file_url = await s3_service.get_presigned_url(s3_key, expiration=3600)
-
-                                # Save attachment record to database
-                                await conn.execute("""
-                                    INSERT INTO purchase_attachments (
-                                        tenant_id,
-                                        purchase_id,
-                                        path,
-                                        file_name,
-                                        file_size,
-                                        mime_type,
-                                        attachment_type,
-                                        description,
-                                        uploaded_by,
-                                        s3_key,
-                                        s3_url
-                                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                                """,
-                                    supplier['tenant_id'],
-                                    purchase_id,
-                                    s3_key,  # path (required)
-                                    file.filename,
-                                    file.size or 0,
-                                    file.content_type or 'application/octet-stream',
-                                    'invoice',
-                                    f'{doc_label}: {invoice_number}',
-                                    purchase['created_by'],  # Use original creator as uploader
-                                    s3_key,
-                                    file_url
-                                )
-                        except Exception as e:
-                            # Continue with other files even if one fails
-                            pass
+                """, purchase_id, purchase['tenant_id'], purchase['status'],
+                    metadata, history_notes, purchase['created_by'])
 
-                return {
-                    "success": True,
-                    "message": f"{doc_label} registrada correctamente"
-                }
+        # Purchase status changed: drop the tenant's cached purchase lists
+        await invalidate_tenant_cache("purchases", purchase['tenant_id'])
+
+        # Attachments are uploaded once the status change is committed
+        if files:
+            await _save_attachments(purchase, purchase_id, files, 'invoice', f'{doc_label}: {invoice_number}')
+
+        return {
+            "success": True,
+            "message": f"{doc_label} registrada correctamente"
+        }
 
     except ValueError:
         raise HTTPException(status_code=400, detail="Datos inválidos")
@@ -526,26 +700,12 @@ async def ship_purchase_from_portal(
         notes: Optional shipping notes
     """
     try:
+        # Reject malformed tokens before taking a pooled connection
+        token_uuid = UUID(token)
+
         async with get_db_connection() as conn:
             # Verify token and that purchase belongs to this supplier
-            supplier = await conn.fetchrow("""
-                SELECT id, tenant_id
-                FROM tenant_suppliers
-                WHERE access_token = $1
-            """, UUID(token))
-
-            if not supplier:
-                raise HTTPException(status_code=404, detail="Token inválido")
-
-            # Verify purchase belongs to supplier
-            purchase = await conn.fetchrow("""
-                SELECT id, status, created_by
-                FROM tenant_purchases
-                WHERE id = $1 AND supplier_id = $2
-            """, purchase_id, supplier['id'])
-
-            if not purchase:
-                raise HTTPException(status_code=404, detail="Compra no encontrada")
+            purchase = await _get_supplier_purchase(conn, token_uuid, purchase_id)
 
             # Validate transition (invoiced -> shipped)
             if purchase['status'] != 'invoiced':
@@ -558,36 +718,32 @@ async def ship_purchase_from_portal(
             delivery_date = None
             if estimated_delivery_date:
                 try:
-                    delivery_date = datetime.fromisoformat(estimated_delivery_date.replace('Z', '+00:00'))
+                    delivery_date = parse_iso_datetime(estimated_delivery_date)
                 except ValueError:
                     pass
 
             async with conn.transaction():
-                # Update purchase with shipping info
-
-                await conn.execute("""
-                    UPDATE tenant_purchases
-                    SET status = 'shipped',
-                        tracking_number = $1,
-                        carrier = $2,
-                        estimated_delivery_date = $3,
-                        package_count = $4,
-                        shipped_at = NOW(),
-                        updated_at = NOW()
-                    WHERE id = $5
-                """, tracking_number, carrier, delivery_date, package_count, purchase_id)
-
-                # Create status history entry
-
                 metadata = {
                     "tracking_number": tracking_number,
                     "carrier": carrier,
                     "package_count": package_count
                 }
 
-                import json
-
+                # Update purchase with shipping info and create the status history
+                # entry in the same statement
                 await conn.execute("""
+                    WITH updated AS (
+                        UPDATE tenant_purchases
+                        SET status = 'shipped',
+                            tracking_number = $1,
+                            carrier = $2,
+                            estimated_delivery_date = $3,
+                            package_count = $4,
+                            shipped_at = NOW(),
+                            updated_at = NOW()
+                        WHERE id = $5
+                        RETURNING id, tenant_id
+                    )
                     INSERT INTO purchase_status_history (
                         purchase_id,
                         tenant_id,
@@ -596,68 +752,24 @@ async def ship_purchase_from_portal(
                         metadata,
                         notes,
                         changed_by
-                    ) VALUES ($1, $2, $3, 'shipped', $4::jsonb, $5, $6)
-                """, purchase_id, supplier['tenant_id'], purchase['status'],
-                    json.dumps(metadata), notes or 'Marcado como enviado por proveedor',
-                    purchase['created_by'])
-
-                # Upload attachments if provided
-                if files:
-
-                    s3_service = AWSS3Service()
-                    for idx, file in enumerate(files):
-                        try:
-
-                            # Upload file to S3/R2
-                            s3_key = await s3_service.upload_file(
-                                file_content=file.file,
-                                filename=file.filename,
-                                folder='purchases/attachments',
-                                content_type=file.content_type
-                            )
-
-                            if s3_key:
-                                # Generate presigned URL
-                                file_url = await s3_service.get_presigned_url(s3_key, expiration=3600)
-
-                                # Save attachment record to database
-
-                                await conn.execute("""
-                                    INSERT INTO purchase_attachments (
-                                        tenant_id,
-                                        purchase_id,
-                                        path,
-                                        file_name,
-                                        file_size,
-                                        mime_type,
-                                        attachment_type,
-                                        description,
-                                        uploaded_by,
-                                        s3_key,
-                                        s3_url
-                                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                                """,
-                                    supplier['tenant_id'],
-                                    purchase_id,
-                                    s3_key,  # path (required)
-                                    file.filename,
-                                    file.size or 0,
-                                    file.content_type or 'application/octet-stream',
-                                    'shipping_label',
-                                    f'Envío {tracking_number} - {carrier}',
-                                    purchase['created_by'],  # Use original creator as uploader
-                                    s3_key,
-                                    file_url
-                                )
-
-                        except Exception as e:
-                            # Continue with other files even if one fails
-                            pass
+                    )
+                    SELECT id, tenant_id, $6::text, 'shipped', $7::jsonb, $8::text, $9::uuid
+                    FROM updated
+                """, tracking_number, carrier, delivery_date, package_count, purchase_id,
+                    purchase['status'], metadata,
+                    notes or 'Marcado como enviado por proveedor', purchase['created_by'])
 
-                return {
-                    "success": True,
-                    "message": "Orden marcada como enviada correctamente"
-                }
+        # Purchase status changed: drop the tenant's cached purchase lists
+        await invalidate_tenant_cache("purchases", purchase['tenant_id'])
+
+        # Attachments are uploaded once the status change is committed
+        if files:
+            await _save_attachments(purchase, purchase_id, files, 'shipping_label', f'Envío {tracking_number} - {carrier}')
+
+        return {
+            "success": True,
+            "message": "Orden marcada como enviada correctamente"
+        }
 
     except ValueError:
         raise HTTPException(status_code=400, detail="Datos inválidos")
@@ -685,98 +797,30 @@ async def get_supplier_invoices(
         Dict with list of invoices
     """
     try:
-        async with get_db_connection() as conn:
+        # Reject malformed tokens and dates before taking a pooled connection
+        token_uuid = UUID(token)
+        parsed_start_date = date.fromisoformat(start_date) if start_date else None
+        parsed_end_date = date.fromisoformat(end_date) if end_date else None
+
+        async with get_db_connection(readonly=True) as conn:
             # First verify the token and get supplier_id
-            supplier = await conn.fetchrow("""
-                SELECT id, tenant_id
-                FROM tenant_suppliers
-                WHERE access_token = $1
-            """, UUID(token))
+            supplier = await _resolve_supplier(conn, token_uuid)
 
             if not supplier:
                 raise HTTPException(status_code=404, detail="Token inválido")
 
-            # Build query with filters
-            query = """
-                SELECT
-                    p.id,
-                    p.purchase_number,
-                    p.purchase_date,
-                    p.invoice_number,
-                    p.invoice_date,
-                    p.invoice_amount,
-                    p.tax_amount,
-                    p.total_amount,
-                    p.status,
-                    p.payment_type,
-                    p.payment_due_date,
-                    p.notes,
-                    p.supplier_id,
-                    s.name as supplier_name,
-                    psh.metadata->>'document_type' as document_type,
-                    psh.metadata->>'numero_factura_legal' as legal_invoice_number,
-                    psh.metadata->>'fecha_factura_legal' as legal_invoice_date
-                FROM tenant_purchases p
-                LEFT JOIN tenant_suppliers s ON p.supplier_id = s.id
-                LEFT JOIN LATERAL (
-                    SELECT metadata
-                    FROM purchase_status_history
-                    WHERE purchase_id = p.id
-                    AND to_status = 'invoiced'
-                    ORDER BY changed_at DESC
-                    LIMIT 1
-                ) psh ON true
-                WHERE p.supplier_id = $1
-                AND p.status IN ('invoiced', 'shipped', 'received', 'paid')
-            """
-
-            params = [supplier['id']]
-            param_count = 2
-
-            # Add document_type filter
-            if document_type:
-                query += f" AND psh.metadata->>'document_type' = ${param_count}"
-                params.append(document_type)
-                param_count += 1
-
-            # Add date filters
-            if start_date:
-                query += f" AND p.invoice_date >= ${param_count}"
-                params.append(start_date)
-                param_count += 1
-
-            if end_date:
-                query += f" AND p.invoice_date <= ${param_count}"
-                params.append(end_date)
-                param_count += 1
-
-            query += " ORDER BY p.invoice_date DESC"
+            # Unused filters are passed as NULL so the query text never changes
+            params = [
+                supplier['id'],
+                document_type or None,
+                parsed_start_date,
+                parsed_end_date
+            ]
 
             # Execute query
-            purchases = await conn.fetch(query, *params)
+            purchases = await conn.fetch(_SELECT_SUPPLIER_INVOICES, *params)
 
-            # Format response
-            invoices = []
-            for purchase in purchases:
-                invoices.append({
-                    "id": str(purchase['id']),
-                    "purchase_number": purchase['purchase_number'],
-                    "purchase_date": purchase['purchase_date'].isoformat() if purchase['purchase_date'] else None,
-                    "invoice_number": purchase['invoice_number'],
-                    "invoice_date": purchase['invoice_date'].isoformat() if purchase['invoice_date'] else None,
-                    "invoice_amount": float(purchase['invoice_amount']) if purchase['invoice_amount'] else None,
-                    "tax_amount": float(purchase['tax_amount']) if purchase['tax_amount'] else 0,
-                    "total_amount": float(purchase['total_amount']) if purchase['total_amount'] else 0,
-                    "status": purchase['status'],
-                    "payment_type": purchase['payment_type'],
-                    "payment_due_date": purchase['payment_due_date'].isoformat() if purchase['payment_due_date'] else None,
-                    "notes": purchase['notes'],
-                    "supplier_id": str(purchase['supplier_id']),
-                    "supplier_name": purchase['supplier_name'],
-                    "document_type": purchase['document_type'],
-                    "legal_invoice_number": purchase['legal_invoice_number'],
-                    "legal_invoice_date": purchase['legal_invoice_date']
-                })
+            invoices = [dict(purchase) for purchase in purchases]
 
             return {
                 "success": True,
@@ -815,152 +859,128 @@ async def attach_legal_invoice(
     Returns:
         Dict with success status
     """
-    print(f"DEBUG attach_legal_invoice called with:")
-    print(f"  token: {token}")
-    print(f"  purchase_ids: {purchase_ids}")
-    print(f"  legal_invoice_number: {legal_invoice_number}")
-    print(f"  legal_invoice_date: {legal_invoice_date}")
-    print(f"  files: {len(files) if files else 0}")
+    logger.debug(
+        "attach_legal_invoice: purchase_ids=%s legal_invoice_number=%s legal_invoice_date=%s files=%s",
+        purchase_ids, legal_invoice_number, legal_invoice_date, len(files) if files else 0
+    )
 
     try:
-        async with get_db_connection() as conn:
-            # Verify supplier token
-            supplier = await conn.fetchrow("""
-                SELECT id, tenant_id, name
-                FROM tenant_suppliers
-                WHERE access_token = $1
-            """, UUID(token))
-
-            if not supplier:
-                raise HTTPException(status_code=404, detail="Token inválido")
+        # Reject malformed tokens before taking a pooled connection
+        token_uuid = UUID(token)
 
-            # Verify all purchases belong to this supplier and are remisiones
-            purchases_check = await conn.fetch("""
-                SELECT p.id, p.purchase_number, p.created_by, psh.metadata->>'document_type' as document_type
-                FROM tenant_purchases p
-                LEFT JOIN LATERAL (
-                    SELECT metadata
-                    FROM purchase_status_history
-                    WHERE purchase_id = p.id
-                    AND to_status = 'invoiced'
-                    ORDER BY changed_at DESC
-                    LIMIT 1
-                ) psh ON true
-                WHERE p.id = ANY($1)
-                AND p.supplier_id = $2
-            """, purchase_ids, supplier['id'])
-
-            if len(purchases_check) != len(purchase_ids):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Algunas órdenes no pertenecen a este proveedor o no existen"
+        async with get_db_connection() as conn:
+            # Verify the token and load the requested purchases of this supplier in
+            # one query: no rows means an unknown token, a NULL id a purchase that
+            # does not belong to the supplier
+            rows = await conn.fetch(_SELECT_SUPPLIER_REMISIONES, token_uuid, purchase_ids)
+
+        if not rows:
+            raise HTTPException(status_code=404, detail="Token inválido")
+
+        tenant_id = rows[0]['tenant_id']
+        purchases_check = [row for row in rows if row['id'] is not None]
+
+        if len(purchases_check) != len(purchase_ids):
+            raise HTTPException(
+                status_code=400,
+                detail="Algunas órdenes no pertenecen a este proveedor o no existen"
+            )
+
+        # Check if all are remisiones
+        non_remisiones = [p for p in purchases_check if p['document_type'] != 'remision']
+        if non_remisiones:
+            raise HTTPException(
+                status_code=400,
+                detail="Solo se puede adjuntar factura legal a remisiones"
+            )
+
+        # Upload files with no pooled connection held, so a burst of slow uploads
+        # cannot exhaust the pool
+        uploaded_files = []
+        if files:
+            s3_service = get_s3_service()
+
+            async def upload_one(file: UploadFile):
+                file_key = f"invoices/{tenant_id}/legal/{legal_invoice_number}/{file.filename}"
+                # Stream the spooled upload to S3 in parts instead of reading it into memory
+                uploaded_key = await s3_service.upload_file_with_key(
+                    file.file,
+                    file_key,
+                    file.content_type
                 )
+                if not uploaded_key:
+                    return None
+                return {
+                    'filename': file.filename,
+                    'key': uploaded_key,
+                    'content_type': file.content_type,
+                    'size': file.size or 0
+                }
 
-            # Check if all are remisiones
-            non_remisiones = [p for p in purchases_check if p['document_type'] != 'remision']
-            if non_remisiones:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Solo se puede adjuntar factura legal a remisiones"
+            named_files = [file for file in files if file.filename]
+            async with _get_upload_semaphore():
+                results = await asyncio.gather(
+                    *(upload_one(file) for file in named_files),
+                    return_exceptions=True
                 )
 
-            # Upload files FIRST (outside transaction) to avoid S3 initialization issues
-            uploaded_files = []
-            if files:
-                s3_service = AWSS3Service()
-                for file in files:
-                    if file.filename:
-                        try:
-                            file_content = await file.read()
-                            file_key = f"invoices/{supplier['tenant_id']}/legal/{legal_invoice_number}/{file.filename}"
-                            # Use the new upload_file_with_key method that accepts a specific key
-                            uploaded_key = await s3_service.upload_file_with_key(
-                                file_content,
-                                file_key,
-                                file.content_type
-                            )
-                            if uploaded_key:
-                                uploaded_files.append({
-                                    'filename': file.filename,
-                                    'key': uploaded_key,
-                                    'content_type': file.content_type,
-                                    'size': len(file_content)
-                                })
-                        except Exception as e:
-                            print(f"Warning: Failed to upload file {file.filename}: {str(e)}")
-                            # Continue with other files even if one fails
-                            pass
-
-            # Now do database transaction
-            async with conn.transaction():
-                # Update metadata in purchase_status_history for each purchase
-                for purchase_id in purchase_ids:
-                    # First check if a status history record exists for 'invoiced'
-                    history_record = await conn.fetchrow("""
-                        SELECT id, metadata
-                        FROM purchase_status_history
-                        WHERE purchase_id = $1
-                        AND to_status = 'invoiced'
-                        ORDER BY changed_at DESC
-                        LIMIT 1
-                    """, purchase_id)
-
-                    if history_record:
-                        # Update existing record
-                        await conn.execute("""
-                            UPDATE purchase_status_history
-                            SET metadata = jsonb_set(
-                                jsonb_set(
-                                    COALESCE(metadata, '{}'::jsonb),
-                                    '{numero_factura_legal}',
-                                    to_jsonb($2::text)
-                                ),
-                                '{fecha_factura_legal}',
-                                to_jsonb($3::text)
-                            )
-                            WHERE id = $1
-                        """, history_record['id'], legal_invoice_number, legal_invoice_date)
-                    else:
-                        # If no history record exists, we need to create one or update the purchase directly
-                        # For now, let's just log a warning and continue
-                        print(f"Warning: No invoiced status history found for purchase {purchase_id}")
-
-                # Create attachment records for uploaded files
-                # Use purchase created_by as uploaded_by (original creator of purchase order)
-                for uploaded_file in uploaded_files:
-                    for purchase_record in purchases_check:
-                        await conn.execute("""
-                            INSERT INTO purchase_attachments
-                            (purchase_id, tenant_id, path, file_name, file_size, s3_key, mime_type, attachment_type, related_status, description, uploaded_by, uploaded_at)
-                            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, NOW())
-                        """,
-                            purchase_record['id'],
-                            supplier['tenant_id'],
-                            uploaded_file['key'],  # path (S3 key)
-                            uploaded_file['filename'],
-                            uploaded_file['size'],
-                            uploaded_file['key'],  # s3_key
-                            uploaded_file['content_type'],
-                            'invoice',  # Valid attachment type
-                            'invoiced',
-                            f'Factura Legal {legal_invoice_number}',  # Description to identify it's a legal invoice
-                            purchase_record['created_by']  # Use original purchase creator as uploader
-                        )
-
-            return {
-                "success": True,
-                "message": f"Factura legal {legal_invoice_number} adjuntada a {len(purchase_ids)} remision(es)",
-                "affected_purchases": len(purchase_ids),
-                "files_uploaded": len(uploaded_files)
-            }
+            for file, result in zip(named_files, results):
+                if isinstance(result, Exception):
+                    # Continue with other files even if one fails
+                    logger.warning(f"Failed to upload file {file.filename}: {str(result)}")
+                elif result is not None:
+                    uploaded_files.append(result)
+
+        # Add the legal invoice to the latest 'invoiced' history row of every
+        # purchase in one statement, using the rows found by the initial check
+        history_ids = []
+        for purchase_record in purchases_check:
+            if purchase_record['history_id'] is None:
+                logger.warning(f"No invoiced status history found for purchase {purchase_record['id']}")
+            else:
+                history_ids.append(purchase_record['history_id'])
+
+        # Create attachment records for uploaded files, one per file and purchase
+        # Use purchase created_by as uploaded_by (original creator of purchase order)
+        attachment_rows = [
+            (
+                purchase_record['id'],
+                tenant_id,
+                uploaded_file['key'],  # path (S3 key)
+                uploaded_file['filename'],
+                uploaded_file['size'],
+                uploaded_file['key'],  # s3_key
+                uploaded_file['content_type'],
+                'invoice',  # Valid attachment type
+                'invoiced',
+                f'Factura Legal {legal_invoice_number}',  # Description to identify it's a legal invoice
+                purchase_record['created_by']  # Use original purchase creator as uploader
+            )
+            for uploaded_file in uploaded_files
+            for purchase_record in purchases_check
+        ]
+
+        # Metadata and attachment records are written together on a fresh connection
+        if history_ids or attachment_rows:
+            async with get_db_connection() as conn:
+                if history_ids:
+                    await conn.execute(_UPDATE_LEGAL_INVOICE_HISTORY, history_ids, legal_invoice_number, legal_invoice_date)
+
+                if attachment_rows:
+                    await conn.executemany(_INSERT_LEGAL_INVOICE_ATTACHMENT, attachment_rows)
+
+        return {
+            "success": True,
+            "message": f"Factura legal {legal_invoice_number} adjuntada a {len(purchase_ids)} remision(es)",
+            "affected_purchases": len(purchase_ids),
+            "files_uploaded": len(uploaded_files)
+        }
 
     except ValueError as e:
-        print(f"ERROR ValueError: {str(e)}")
+        logger.warning(f"Invalid data attaching legal invoice: {str(e)}")
         raise HTTPException(status_code=400, detail="Datos inválidos")
     except HTTPException:
         raise
     except Exception as e:
-        print(f"ERROR Exception: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error attaching legal invoice: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al adjuntar factura legal: {str(e)}")
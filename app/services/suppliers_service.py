@@ -5,6 +5,8 @@ from fastapi import Request, Response, HTTPException
 from app.database import get_db_connection
 from app.core.middleware import require_valid_session
 from app.core.exceptions import AuthenticationError
+from app.services.reference_cache import notify_supplier_changed
+from app.utils.pagination import encode_cursor, decode_cursor
 from app.models.supplier import (
     Supplier,
     SupplierCreate,
@@ -15,6 +17,38 @@ from app.models.supplier import (
 
 logger = logging.getLogger(__name__)
 
+# Partial update from a JSON patch: only keys present in the patch are written
+# (an explicit null clears the column), so one statement serves every field set.
+# jsonb_populate_record converts each value to the column type
+_UPDATE_SUPPLIER = """
+    UPDATE tenant_suppliers t
+    SET
+        name = CASE WHEN $3::jsonb ? 'name' THEN patch.name ELSE t.name END,
+        contact_info = CASE WHEN $3::jsonb ? 'contact_info' THEN patch.contact_info ELSE t.contact_info END,
+        tax_id = CASE WHEN $3::jsonb ? 'tax_id' THEN patch.tax_id ELSE t.tax_id END,
+        address = CASE WHEN $3::jsonb ? 'address' THEN patch.address ELSE t.address END,
+        phone = CASE WHEN $3::jsonb ? 'phone' THEN patch.phone ELSE t.phone END,
+        email = CASE WHEN $3::jsonb ? 'email' THEN patch.email ELSE t.email END,
+        payment_terms = CASE WHEN $3::jsonb ? 'payment_terms' THEN patch.payment_terms ELSE t.payment_terms END,
+        is_active = CASE WHEN $3::jsonb ? 'is_active' THEN patch.is_active ELSE t.is_active END,
+        updated_at = NOW()
+    FROM jsonb_populate_record(NULL::tenant_suppliers, $3::jsonb) patch
+    WHERE t.id = $1 AND t.tenant_id = $2
+    RETURNING
+        t.id,
+        t.tenant_id,
+        t.name,
+        t.contact_info,
+        t.tax_id,
+        t.address,
+        t.phone,
+        t.email,
+        t.payment_terms,
+        t.is_active,
+        t.created_at,
+        t.updated_at
+"""
+
 async def get_suppliers_list(
     request: Request,
     response: Response,
@@ -22,10 +56,12 @@ async def get_suppliers_list(
     limit: int = 50,
     search: Optional[str] = None,
     is_active: Optional[bool] = None,
-    payment_terms: Optional[str] = None
+    payment_terms: Optional[str] = None,
+    cursor: Optional[str] = None
 ) -> SuppliersListResponse:
     """
     Get suppliers list with tenant isolation following database governance
+    Pages by cursor (keyset) when given, otherwise by page/limit
     """
     try:
         session_context = require_valid_session(request)
@@ -36,93 +72,98 @@ async def get_suppliers_list(
 
         async with get_db_connection() as conn:
             # Build query with tenant isolation
-            base_query = """
-                SELECT
-                    id,
-                    tenant_id,
-                    name,
-                    contact_info,
-                    tax_id,
-                    address,
-                    phone,
-                    email,
-                    payment_terms,
-                    is_active,
-                    access_token,
-                    created_at,
-                    updated_at
-                FROM tenant_suppliers
-                WHERE tenant_id = $1
-            """
-            
-            count_query = """
-                SELECT COUNT(*) as total
-                FROM tenant_suppliers 
-                WHERE tenant_id = $1
-            """
-            
+            filters = ""
             params = [tenant_id]
             param_count = 2
             
             # Add filters
             if search:
-                base_query += f" AND (LOWER(name) LIKE LOWER(${param_count}) OR LOWER(tax_id) LIKE LOWER(${param_count}))"
-                count_query += f" AND (LOWER(name) LIKE LOWER(${param_count}) OR LOWER(tax_id) LIKE LOWER(${param_count}))"
+                filters += f" AND (name ILIKE ${param_count} OR tax_id ILIKE ${param_count})"
                 params.append(f"%{search}%")
                 param_count += 1
             
             if is_active is not None:
-                base_query += f" AND is_active = ${param_count}"
-                count_query += f" AND is_active = ${param_count}"
+                filters += f" AND is_active = ${param_count}"
                 params.append(is_active)
                 param_count += 1
             
             if payment_terms:
-                base_query += f" AND LOWER(payment_terms) = LOWER(${param_count})"
-                count_query += f" AND LOWER(payment_terms) = LOWER(${param_count})"
+                filters += f" AND LOWER(payment_terms) = LOWER(${param_count})"
                 params.append(payment_terms)
                 param_count += 1
             
             # Add pagination
-            offset = (page - 1) * limit
-            base_query += f" ORDER BY created_at DESC LIMIT ${param_count} OFFSET ${param_count + 1}"
-            params.extend([limit, offset])
+            filter_params = list(params)
+            if cursor:
+                # Keyset: seek past the last row of the previous page, no rows
+                # discarded; the total is not computed for cursor pages
+                total_column = "NULL::bigint"
+                pagination = (
+                    f" AND (created_at, id) < (${param_count}, ${param_count + 1})"
+                    f" ORDER BY created_at DESC, id DESC LIMIT ${param_count + 2}"
+                )
+                params.extend([*decode_cursor(cursor), limit])
+            else:
+                # The window count returns the filtered total with the page rows
+                total_column = "COUNT(*) OVER()"
+                offset = (page - 1) * limit
+                pagination = f" ORDER BY created_at DESC, id DESC LIMIT ${param_count} OFFSET ${param_count + 1}"
+                params.extend([limit, offset])
+
+            base_query = f"""
+                SELECT
+                    id,
+                    tenant_id,
+                    name,
+                    contact_info,
+                    tax_id,
+                    address,
+                    phone,
+                    email,
+                    payment_terms,
+                    is_active,
+                    access_token,
+                    created_at,
+                    updated_at,
+                    {total_column} as total_count
+                FROM tenant_suppliers
+                WHERE tenant_id = $1
+            """ + filters + pagination
             
-            # Execute queries
+            # Execute query
             suppliers_data = await conn.fetch(base_query, *params)
-            count_result = await conn.fetchrow(count_query, *params[:-2])  # Exclude limit and offset
+            total = suppliers_data[0]['total_count'] if suppliers_data else None
 
-            # Convert to models
-            suppliers = []
-            for row in suppliers_data:
-                supplier = Supplier(
-                    id=row['id'],
-                    tenantId=row['tenant_id'],
-                    name=row['name'],
-                    contact_info=row['contact_info'],
-                    tax_id=row['tax_id'],
-                    address=row['address'],
-                    phone=row['phone'],
-                    email=row['email'],
-                    payment_terms=row['payment_terms'],
-                    is_active=row['is_active'],
-                    access_token=row['access_token'],
-                    createdAt=row['created_at'],
-                    updatedAt=row['updated_at']
-                )
-                suppliers.append(supplier)
+            # Past the last page there is no row to carry the total
+            if not cursor and not suppliers_data:
+                total = await conn.fetchval(
+                    "SELECT COUNT(*) FROM tenant_suppliers WHERE tenant_id = $1" + filters,
+                    *filter_params
+                ) if offset else 0
+
+            # Rows come from the database already typed: skip model validation
+            suppliers = [Supplier.model_construct(**row) for row in suppliers_data]
+
+            # A full page means there may be more rows after the last one
+            next_cursor = None
+            if len(suppliers_data) == limit:
+                last_row = suppliers_data[-1]
+                next_cursor = encode_cursor(last_row['created_at'], last_row['id'])
 
             response_data = SuppliersListResponse(
                 data=suppliers,
-                total=count_result['total'],
+                total=total,
                 page=page,
-                limit=limit
+                limit=limit,
+                next_cursor=next_cursor
             )
 
             return response_data
 
     except AuthenticationError:
         raise
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error fetching suppliers: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
@@ -165,21 +206,7 @@ async def get_supplier_by_id(
             if not supplier_data:
                 raise HTTPException(status_code=404, detail="Supplier not found")
 
-            supplier = Supplier(
-                id=supplier_data['id'],
-                tenantId=supplier_data['tenant_id'],
-                name=supplier_data['name'],
-                contact_info=supplier_data['contact_info'],
-                tax_id=supplier_data['tax_id'],
-                address=supplier_data['address'],
-                phone=supplier_data['phone'],
-                email=supplier_data['email'],
-                payment_terms=supplier_data['payment_terms'],
-                is_active=supplier_data['is_active'],
-                access_token=supplier_data['access_token'],
-                createdAt=supplier_data['created_at'],
-                updatedAt=supplier_data['updated_at']
-            )
+            supplier = Supplier.model_construct(**supplier_data)
             
             return SupplierResponse(data=supplier)
             
@@ -245,20 +272,7 @@ async def create_supplier(
                 supplier_data.is_active
             )
             
-            supplier = Supplier(
-                id=new_supplier['id'],
-                tenantId=new_supplier['tenant_id'],
-                name=new_supplier['name'],
-                contact_info=new_supplier['contact_info'],
-                tax_id=new_supplier['tax_id'],
-                address=new_supplier['address'],
-                phone=new_supplier['phone'],
-                email=new_supplier['email'],
-                payment_terms=new_supplier['payment_terms'],
-                is_active=new_supplier['is_active'],
-                createdAt=new_supplier['created_at'],
-                updatedAt=new_supplier['updated_at']
-            )
+            supplier = Supplier.model_construct(**new_supplier)
             
             return SupplierResponse(data=supplier)
             
@@ -285,66 +299,21 @@ async def update_supplier(
             raise AuthenticationError("Tenant ID is required")
 
         async with get_db_connection() as conn:
-            # Verify supplier exists and belongs to tenant
-            existing_supplier = await conn.fetchrow("""
-                SELECT id FROM tenant_suppliers
-                WHERE id = $1 AND tenant_id = $2
-            """, supplier_id, tenant_id)
+            if not supplier_data.model_fields_set:
+                raise HTTPException(status_code=400, detail="No fields to update")
+
+            # The UPDATE doubles as the tenant ownership check
+            patch = supplier_data.model_dump(mode='json', exclude_unset=True)
+            updated_supplier = await conn.fetchrow(_UPDATE_SUPPLIER, supplier_id, tenant_id, patch)
 
-            if not existing_supplier:
+            if not updated_supplier:
                 raise HTTPException(status_code=404, detail="Supplier not found")
+
+            # Supplier name is shown on purchases: on commit every worker drops its
+            # cached name and then the tenant's cached lists
+            await notify_supplier_changed(conn, supplier_id, tenant_id)
             
-            # Build update query dynamically
-            update_fields = []
-            params = [supplier_id, tenant_id]
-            param_count = 3
-            
-            for field, value in supplier_data.dict(exclude_unset=True).items():
-                update_fields.append(f"{field} = ${param_count}")
-                params.append(value)
-                param_count += 1
-            
-            if not update_fields:
-                raise HTTPException(status_code=400, detail="No fields to update")
-            
-            # Add updated_at
-            update_fields.append(f"updated_at = NOW()")
-            
-            update_query = f"""
-                UPDATE tenant_suppliers 
-                SET {', '.join(update_fields)}
-                WHERE id = $1 AND tenant_id = $2
-                RETURNING 
-                    id,
-                    tenant_id,
-                    name,
-                    contact_info,
-                    tax_id,
-                    address,
-                    phone,
-                    email,
-                    payment_terms,
-                    is_active,
-                    created_at,
-                    updated_at
-            """
-            
-            updated_supplier = await conn.fetchrow(update_query, *params)
-            
-            supplier = Supplier(
-                id=updated_supplier['id'],
-                tenantId=updated_supplier['tenant_id'],
-                name=updated_supplier['name'],
-                contact_info=updated_supplier['contact_info'],
-                tax_id=updated_supplier['tax_id'],
-                address=updated_supplier['address'],
-                phone=updated_supplier['phone'],
-                email=updated_supplier['email'],
-                payment_terms=updated_supplier['payment_terms'],
-                is_active=updated_supplier['is_active'],
-                createdAt=updated_supplier['created_at'],
-                updatedAt=updated_supplier['updated_at']
-            )
+            supplier = Supplier.model_construct(**updated_supplier)
             
             return SupplierResponse(data=supplier)
             
@@ -372,25 +341,22 @@ async def delete_supplier(
             raise AuthenticationError("Tenant ID is required")
 
         async with get_db_connection() as conn:
-            # Verify supplier exists and belongs to tenant
-            existing_supplier = await conn.fetchrow("""
-                SELECT id FROM tenant_suppliers 
+            # Delete supplier; RETURNING doubles as the tenant ownership check
+            deleted_id = await conn.fetchval("""
+                DELETE FROM tenant_suppliers
                 WHERE id = $1 AND tenant_id = $2
+                RETURNING id
             """, supplier_id, tenant_id)
-            
-            if not existing_supplier:
+
+            if not deleted_id:
                 raise HTTPException(status_code=404, detail="Supplier not found")
-            
-            # Delete supplier
-            await conn.execute("""
-                DELETE FROM tenant_suppliers 
-                WHERE id = $1 AND tenant_id = $2
-            """, supplier_id, tenant_id)
-            
-            return {
-                "success": True,
-                "message": "Supplier deleted successfully"
-            }
+
+            await notify_supplier_changed(conn, supplier_id, tenant_id)
+
+        return {
+            "success": True,
+            "message": "Supplier deleted successfully"
+        }
             
     except AuthenticationError:
         raise
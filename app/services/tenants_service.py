@@ -19,30 +19,27 @@ async def get_user_tenants(request: Request) -> UserTenantsResponse:
         
         
         async with get_db_connection() as conn:
-            # Get tenants for the user
+            # Get tenants for the user (semi-join: one row per tenant, no dedup sort)
             query = """
-                SELECT DISTINCT 
+                SELECT
                   t.id,
                   t.name,
                   t.slug
                 FROM tenants t
-                INNER JOIN tenant_members tm ON t.id = tm.tenant_id
-                WHERE tm.user_id = $1
+                WHERE EXISTS (
+                  SELECT 1
+                  FROM tenant_members tm
+                  WHERE tm.tenant_id = t.id
+                  AND tm.user_id = $1
+                )
                 ORDER BY t.name
             """
             
             tenant_rows = await conn.fetch(query, user_id)
             
             
-            # Convert to Tenant models
-            tenants = []
-            for row in tenant_rows:
-                tenant = Tenant(
-                    id=row['id'],
-                    name=row['name'],
-                    slug=row['slug']
-                )
-                tenants.append(tenant)
+            # Convert to Tenant models; rows come from the database already typed
+            tenants = [Tenant.model_construct(**row) for row in tenant_rows]
             
             return UserTenantsResponse(
                 data=tenants,
@@ -0,0 +1,18 @@
+"""
+Date parsing helpers
+"""
+from datetime import datetime
+from functools import lru_cache
+
+@lru_cache(maxsize=1024)
+def parse_iso_datetime(value: str) -> datetime:
+    """
+    Parse an ISO 8601 string as sent by the frontend, including a trailing 'Z'
+    (not accepted by datetime.fromisoformat before Python 3.11)
+
+    Raises:
+        ValueError: If the string is not a valid ISO 8601 datetime
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
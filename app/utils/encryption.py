@@ -3,14 +3,21 @@ Simple encryption utilities for secure origin verification
 """
 import base64
 import hashlib
-from datetime import datetime
+import hmac
+import time
+from functools import lru_cache
 from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Encoded "origin|timestamp|key_part" payloads are far below this; anything longer
+# is rejected before decoding
+MAX_ENCRYPTED_ORIGIN_LENGTH = 1024
+
+@lru_cache(maxsize=1)
 def get_simple_key():
-    """Get simple encryption key from settings"""
+    """Get simple encryption key from settings (derived once, settings are static)"""
     try:
         # Use a part of the JWT secret as encryption key (simpler approach)
         jwt_secret = getattr(settings, 'jwt_secret', None)
@@ -24,6 +31,11 @@ def get_simple_key():
         logger.error(f"Error getting simple encryption key: {e}")
         return None
 
+@lru_cache(maxsize=1)
+def _get_key_part() -> bytes:
+    """Key prefix embedded in the origin payload by the frontend, as UTF-8 bytes"""
+    return get_simple_key()[:8].decode('utf-8', errors='ignore').encode()
+
 def decrypt_origin(encrypted_origin: str) -> str:
     """
     Decrypt the simple encrypted origin sent from frontend
@@ -34,42 +46,46 @@ def decrypt_origin(encrypted_origin: str) -> str:
     Returns:
         Decrypted origin string or None if decryption fails
     """
+    key = get_simple_key()
+    if not key:
+        return None
+
+    # btoa output is padded to a multiple of 4: reject anything else unread
+    length = len(encrypted_origin)
+    if length == 0 or length > MAX_ENCRYPTED_ORIGIN_LENGTH or length % 4:
+        logger.warning("❌ Invalid encrypted payload format")
+        return None
+
+    # Simple decode from base64 (match frontend btoa); the payload stays as bytes
     try:
-        key = get_simple_key()
-        if not key:
-            return None
-        
-        # Simple decode from base64 (match frontend btoa)
-        try:
-            decoded = base64.b64decode(encrypted_origin.encode()).decode()
-            
-            # Parse the payload: origin|timestamp|key_part
-            parts = decoded.split('|')
-            if len(parts) >= 3:
-                origin = parts[0]
-                timestamp = parts[1]
-                sent_key_part = parts[2]
-                
-                # Verify key part matches
-                expected_key_part = key[:8].decode('utf-8', errors='ignore')
-                if sent_key_part == expected_key_part:
-                    logger.info(f"✅ Successfully decrypted origin: {origin}")
-                    return origin
-                else:
-                    logger.warning(f"❌ Key verification failed")
-                    return None
-            else:
-                logger.warning(f"❌ Invalid encrypted payload format")
-                return None
-                
-        except Exception as e:
-            logger.warning(f"❌ Error parsing encrypted origin: {e}")
-            return None
-        
-    except Exception as e:
-        logger.error(f"❌ Error decrypting origin: {e}")
+        # validate=True rejects non-alphabet characters up front instead of skipping them
+        decoded = base64.b64decode(encrypted_origin, validate=True)
+    except ValueError as e:
+        logger.warning("❌ Error parsing encrypted origin: %s", e)
         return None
 
+    # Parse the payload: exactly origin|timestamp|key_part
+    origin_bytes, sep, rest = decoded.partition(b'|')
+    _timestamp, sep2, sent_key_part = rest.partition(b'|')
+    if not sep or not sep2 or b'|' in sent_key_part:
+        logger.warning("❌ Invalid encrypted payload format")
+        return None
+
+    # Verify key part matches (constant time: it is part of the secret)
+    if not hmac.compare_digest(sent_key_part, _get_key_part()):
+        logger.warning("❌ Key verification failed")
+        return None
+
+    # Only the origin itself needs to be text
+    try:
+        origin = origin_bytes.decode()
+    except UnicodeDecodeError as e:
+        logger.warning("❌ Error parsing encrypted origin: %s", e)
+        return None
+
+    logger.info("✅ Successfully decrypted origin: %s", origin)
+    return origin
+
 def encrypt_origin(origin: str) -> str:
     """
     Encrypt origin for testing purposes (matches frontend implementation)
@@ -86,17 +102,16 @@ def encrypt_origin(origin: str) -> str:
             return None
             
         # Get timestamp and key part (match frontend)
-        timestamp = str(int(datetime.now().timestamp() * 1000))  # JavaScript Date.now() format
-        key_part = key[:8].decode('utf-8', errors='ignore')
+        timestamp = str(time.time_ns() // 1_000_000)  # JavaScript Date.now() format
         
         # Create payload: origin|timestamp|key_part
-        payload = f"{origin}|{timestamp}|{key_part}"
+        payload = b"|".join((origin.encode(), timestamp.encode(), _get_key_part()))
         
         # Simple base64 encoding (match frontend btoa)
-        encoded = base64.b64encode(payload.encode()).decode()
+        encoded = base64.b64encode(payload).decode()
         
         return encoded
         
     except Exception as e:
-        logger.error(f"❌ Error encrypting origin: {e}")
+        logger.error("❌ Error encrypting origin: %s", e)
         return None
\ No newline at end of file
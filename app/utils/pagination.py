@@ -0,0 +1,24 @@
+"""
+Keyset pagination helpers
+Cursors are opaque base64 strings of "created_at|id" for the last row of a page
+"""
+import base64
+import binascii
+from datetime import datetime
+from typing import Tuple
+from uuid import UUID
+from fastapi import HTTPException
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    """Build the cursor that points just after the given row"""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """Parse a cursor back into (created_at, id), 400 if it was tampered with"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
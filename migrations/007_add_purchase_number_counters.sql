@@ -0,0 +1,53 @@
+-- Migration: Add per-tenant purchase number counters
+-- Description: Allocates WR-YYYY-NNNN purchase numbers atomically instead of
+--              reading the last purchase number and incrementing it in Python
+-- Date: 2025-11-20
+
+BEGIN;
+
+-- ============================================================================
+-- 1. CREATE COUNTERS TABLE
+-- ============================================================================
+-- One row per (tenant, year). The row is upserted with
+-- INSERT ... ON CONFLICT DO UPDATE ... RETURNING last_seq, so concurrent
+-- purchase creations serialize on the row lock and never get the same number.
+
+CREATE TABLE IF NOT EXISTS tenant_purchase_counters (
+    tenant_id UUID NOT NULL,
+    year INTEGER NOT NULL,
+    last_seq INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    PRIMARY KEY (tenant_id, year),
+
+    CONSTRAINT fk_purchase_counters_tenant
+        FOREIGN KEY (tenant_id)
+        REFERENCES tenants(id)
+        ON DELETE CASCADE,
+
+    CONSTRAINT chk_purchase_counters_last_seq
+        CHECK (last_seq >= 0)
+);
+
+-- ============================================================================
+-- 2. SEED FROM EXISTING PURCHASE NUMBERS
+-- ============================================================================
+-- Start every counter at the highest number already issued so new purchases
+-- continue the existing sequence.
+
+INSERT INTO tenant_purchase_counters (tenant_id, year, last_seq)
+SELECT
+    tenant_id,
+    split_part(purchase_number, '-', 2)::int AS year,
+    MAX(split_part(purchase_number, '-', 3)::int) AS last_seq
+FROM tenant_purchases
+WHERE purchase_number ~ '^WR-[0-9]{4}-[0-9]+$'
+GROUP BY tenant_id, split_part(purchase_number, '-', 2)::int
+ON CONFLICT (tenant_id, year) DO UPDATE
+    SET last_seq = GREATEST(tenant_purchase_counters.last_seq, EXCLUDED.last_seq),
+        updated_at = NOW();
+
+COMMENT ON TABLE tenant_purchase_counters IS 'Last purchase number sequence issued per tenant and year (WR-YYYY-NNNN)';
+COMMENT ON COLUMN tenant_purchase_counters.last_seq IS 'Last NNNN issued for this tenant/year';
+
+COMMIT;
@@ -0,0 +1,30 @@
+-- Migration: Add indexes for purchase list pagination
+-- Description: Serves the purchases list (WHERE tenant_id = $1 ORDER BY created_at DESC)
+--              with an index range scan instead of a heap scan + sort, and indexes
+--              purchase items by purchase
+-- Date: 2025-11-21
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+-- ============================================================================
+-- 1. PURCHASES LIST INDEX
+-- ============================================================================
+-- Key order matches the list query ORDER BY; id is the tiebreaker for rows
+-- created in the same transaction. INCLUDE columns are the ones the list
+-- filters on, so the COUNT(*) for search/status/supplier filters can be
+-- answered from the index alone.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tp_tenant_created
+    ON tenant_purchases (tenant_id, created_at DESC, id DESC)
+    INCLUDE (supplier_id, status, purchase_number, invoice_number);
+
+-- ============================================================================
+-- 2. PURCHASE ITEMS BY PURCHASE
+-- ============================================================================
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_purchase_items_purchase_id
+    ON tenant_purchase_items (purchase_id);
+
+COMMENT ON INDEX idx_tp_tenant_created IS 'Purchases list pagination per tenant, newest first';
+COMMENT ON INDEX idx_purchase_items_purchase_id IS 'Items lookup by purchase';
@@ -0,0 +1,19 @@
+-- Migration: Add index for purchase list payment filters
+-- Description: Supports the payment_status filter (payment_due_date ranges) of the
+--              purchases list
+-- Date: 2025-11-22
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+-- ============================================================================
+-- 1. PAYMENT DUE DATE PER TENANT
+-- ============================================================================
+-- overdue / due_this_week filter on payment_due_date ranges; purchases without
+-- a due date never match those filters, so they are left out of the index.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tp_tenant_payment_due
+    ON tenant_purchases (tenant_id, payment_due_date)
+    WHERE payment_due_date IS NOT NULL;
+
+COMMENT ON INDEX idx_tp_tenant_payment_due IS 'Purchases list payment_status filters per tenant';
@@ -0,0 +1,15 @@
+-- Migration: Add trigram index for purchase search
+-- Description: Lets the purchases list search (purchase_number / invoice_number
+--              ILIKE '%term%') use an index instead of scanning every tenant row
+-- Date: 2025-11-22
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tp_search_trgm
+    ON tenant_purchases
+    USING gin (purchase_number gin_trgm_ops, invoice_number gin_trgm_ops);
+
+COMMENT ON INDEX idx_tp_search_trgm IS 'Substring search on purchase and invoice numbers (ILIKE)';
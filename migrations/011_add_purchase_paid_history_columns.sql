@@ -0,0 +1,80 @@
+-- Migration: Denormalize the latest paid transition onto tenant_purchases
+-- Description: Copies payment method/reference/date of the most recent 'paid' status
+--              history row into tenant_purchases via trigger, so the purchases list
+--              no longer needs a LATERAL lookup into purchase_status_history per row
+-- Date: 2025-11-23
+
+BEGIN;
+
+-- ============================================================================
+-- 1. ADD PAID HISTORY COLUMNS
+-- ============================================================================
+
+ALTER TABLE tenant_purchases
+    ADD COLUMN IF NOT EXISTS paid_payment_method TEXT,
+    ADD COLUMN IF NOT EXISTS paid_payment_reference TEXT,
+    ADD COLUMN IF NOT EXISTS paid_changed_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN tenant_purchases.paid_payment_method IS 'payment_method from the latest paid status history row (maintained by trigger)';
+COMMENT ON COLUMN tenant_purchases.paid_payment_reference IS 'payment_reference from the latest paid status history row (maintained by trigger)';
+COMMENT ON COLUMN tenant_purchases.paid_changed_at IS 'changed_at of the latest paid status history row (maintained by trigger)';
+
+-- ============================================================================
+-- 2. CREATE TRIGGER FUNCTION FOR PAID TRANSITIONS
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION sync_purchase_paid_history()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE tenant_purchases
+    SET
+        paid_payment_method = NEW.metadata->>'payment_method',
+        paid_payment_reference = NEW.metadata->>'payment_reference',
+        paid_changed_at = NEW.changed_at
+    WHERE id = NEW.purchase_id
+    AND (paid_changed_at IS NULL OR paid_changed_at <= NEW.changed_at);
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create trigger
+DROP TRIGGER IF EXISTS trg_purchase_paid_history ON purchase_status_history;
+CREATE TRIGGER trg_purchase_paid_history
+    AFTER INSERT ON purchase_status_history
+    FOR EACH ROW
+    WHEN (NEW.to_status = 'paid')
+    EXECUTE FUNCTION sync_purchase_paid_history();
+
+COMMENT ON FUNCTION sync_purchase_paid_history() IS 'Keeps tenant_purchases.paid_* in sync with the latest paid status history row';
+
+-- ============================================================================
+-- 3. BACKFILL EXISTING PURCHASES
+-- ============================================================================
+
+UPDATE tenant_purchases tp
+SET
+    paid_payment_method = psh.metadata->>'payment_method',
+    paid_payment_reference = psh.metadata->>'payment_reference',
+    paid_changed_at = psh.changed_at
+FROM (
+    SELECT DISTINCT ON (purchase_id) purchase_id, changed_at, metadata
+    FROM purchase_status_history
+    WHERE to_status = 'paid'
+    ORDER BY purchase_id, changed_at DESC
+) psh
+WHERE tp.id = psh.purchase_id;
+
+COMMIT;
+
+-- ============================================================================
+-- ROLLBACK SCRIPT (if needed)
+-- ============================================================================
+-- BEGIN;
+-- DROP TRIGGER IF EXISTS trg_purchase_paid_history ON purchase_status_history;
+-- DROP FUNCTION IF EXISTS sync_purchase_paid_history();
+-- ALTER TABLE tenant_purchases
+--     DROP COLUMN IF EXISTS paid_payment_method,
+--     DROP COLUMN IF EXISTS paid_payment_reference,
+--     DROP COLUMN IF EXISTS paid_changed_at;
+-- COMMIT;
@@ -0,0 +1,35 @@
+-- Migration: Add indexes for supplier portal lookups
+-- Description: Every portal request resolves the supplier by access_token, and the
+--              portal purchase list filters by supplier (optionally by status) newest
+--              first. Items by purchase are already covered by
+--              idx_purchase_items_purchase_id (migration 008).
+-- Date: 2025-11-24
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+-- ============================================================================
+-- 1. SUPPLIER BY ACCESS TOKEN
+-- ============================================================================
+-- Tokens identify a single supplier, so the index is unique. The portal resolves
+-- token -> (id, tenant_id) on every request (and joins on it to check purchase
+-- ownership); including both columns lets PostgreSQL answer it with an index-only
+-- scan. If a duplicate token exists the build fails and leaves an INVALID index:
+-- fix the data, drop the index and run it again.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_suppliers_access_token
+    ON tenant_suppliers (access_token)
+    INCLUDE (id, tenant_id);
+
+-- ============================================================================
+-- 2. PURCHASES PER SUPPLIER
+-- ============================================================================
+-- WHERE supplier_id = $1 [AND status = $2] ORDER BY created_at DESC; status is
+-- included so the filter is checked without visiting the heap.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tp_supplier_created
+    ON tenant_purchases (supplier_id, created_at DESC)
+    INCLUDE (status);
+
+COMMENT ON INDEX idx_tenant_suppliers_access_token IS 'Supplier portal token lookup (index-only for id, tenant_id)';
+COMMENT ON INDEX idx_tp_supplier_created IS 'Supplier portal purchases per supplier, newest first';
@@ -0,0 +1,20 @@
+-- Migration: Add index for the latest invoiced transition per purchase
+-- Description: The supplier portal invoice list reads the most recent 'invoiced'
+--              status history row of each purchase (document type and legal invoice
+--              data live in its metadata)
+-- Date: 2025-11-26
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+-- ============================================================================
+-- 1. LATEST INVOICED TRANSITION PER PURCHASE
+-- ============================================================================
+-- WHERE purchase_id = ? AND to_status = 'invoiced' ORDER BY changed_at DESC LIMIT 1
+-- becomes a single index seek per purchase instead of reading every history row.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_purchase_status_history_invoiced
+    ON purchase_status_history (purchase_id, changed_at DESC)
+    WHERE to_status = 'invoiced';
+
+COMMENT ON INDEX idx_purchase_status_history_invoiced IS 'Latest invoiced transition per purchase';
@@ -0,0 +1,15 @@
+-- Migration: Add trigram index for supplier search
+-- Description: Lets the suppliers list search (name / tax_id ILIKE '%term%') use an
+--              index instead of scanning every tenant row
+-- Date: 2025-11-26
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_suppliers_search_trgm
+    ON tenant_suppliers
+    USING gin (name gin_trgm_ops, tax_id gin_trgm_ops);
+
+COMMENT ON INDEX idx_tenant_suppliers_search_trgm IS 'Substring search on supplier name and tax id (ILIKE)';
@@ -0,0 +1,13 @@
+-- Migration: Add index for tenant memberships per user
+-- Description: get_user_tenants looks up the tenants of the session user with an
+--              EXISTS on tenant_members (user_id, tenant_id); both columns in the
+--              index let it run as an index-only scan
+-- Date: 2025-11-26
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_members_user_tenant
+    ON tenant_members (user_id, tenant_id);
+
+COMMENT ON INDEX idx_tenant_members_user_tenant IS 'Tenants of a user (session tenant list)';
@@ -0,0 +1,30 @@
+-- Migration: Add indexes for the suppliers list and per-purchase status history
+-- Description: The suppliers list filters by tenant newest first, and the status
+--              history endpoint reads every transition of a purchase newest first.
+--              The supplier access_token lookup is already covered by migration 013
+--              and the latest paid/invoiced lookups by migrations 009 and 014.
+-- Date: 2025-11-26
+--
+-- NOTE: CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so this
+--       migration has no BEGIN/COMMIT. Run each statement on its own (psql -f works).
+
+-- ============================================================================
+-- 1. SUPPLIERS PER TENANT
+-- ============================================================================
+-- WHERE tenant_id = $1 [AND filters] ORDER BY created_at DESC, id DESC LIMIT ... :
+-- rows come out of the index already sorted, so a page stops after LIMIT matches,
+-- and keyset pages seek straight to (created_at, id).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tenant_suppliers_tenant_created
+    ON tenant_suppliers (tenant_id, created_at DESC, id DESC);
+
+-- ============================================================================
+-- 2. STATUS HISTORY PER PURCHASE
+-- ============================================================================
+-- WHERE purchase_id = $1 ORDER BY changed_at DESC without a sort step.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_purchase_status_history_purchase_changed
+    ON purchase_status_history (purchase_id, changed_at DESC);
+
+COMMENT ON INDEX idx_tenant_suppliers_tenant_created IS 'Suppliers list per tenant, newest first';
+COMMENT ON INDEX idx_purchase_status_history_purchase_changed IS 'Status history of a purchase, newest first';
@@ -6,47 +6,46 @@ import asyncio
 import asyncpg
 from app.config import settings
 
+_ADD_PAYMENT_COLUMNS = """
+    ALTER TABLE tenant_purchases
+    ADD COLUMN IF NOT EXISTS payment_amount NUMERIC,
+    ADD COLUMN IF NOT EXISTS payment_date TIMESTAMP WITH TIME ZONE
+"""
+
+_VERIFY_PAYMENT_COLUMNS = """
+    SELECT column_name, data_type
+    FROM information_schema.columns
+    WHERE table_name = 'tenant_purchases'
+    AND column_name IN ('payment_amount', 'payment_date')
+    ORDER BY column_name
+"""
+
 async def run_migration():
     """Add missing payment columns to tenant_purchases table"""
 
-    # Create connection
-    conn = await asyncpg.connect(
-        host=settings.db_host,
-        port=settings.db_port,
-        user=settings.db_user,
-        password=settings.db_password,
-        database=settings.db_name
-    )
+    # Create connection (a single run, so no pool)
+    conn = await asyncpg.connect(**settings.db_connection_params, command_timeout=60)
 
     try:
         print("🔧 Running migration: add payment_amount and payment_date columns...")
 
-        # Add columns
-        await conn.execute("""
-            ALTER TABLE tenant_purchases
-            ADD COLUMN IF NOT EXISTS payment_amount NUMERIC,
-            ADD COLUMN IF NOT EXISTS payment_date TIMESTAMP WITH TIME ZONE
-        """)
-
-        print("✅ Columns added successfully")
-
-        # Verify
-        result = await conn.fetch("""
-            SELECT column_name, data_type
-            FROM information_schema.columns
-            WHERE table_name = 'tenant_purchases'
-            AND column_name IN ('payment_amount', 'payment_date')
-            ORDER BY column_name
-        """)
-
-        print("\n✅ Verification:")
-        for row in result:
-            print(f"  - {row['column_name']}: {row['data_type']}")
-
-        if len(result) == 2:
-            print("\n✅ Migration completed successfully!")
-        else:
-            print("\n❌ Migration may have failed - columns not found")
+        # ALTER and verification run in one transaction: a failed check rolls
+        # the DDL back instead of leaving a half-applied migration
+        async with conn.transaction():
+            # Add columns
+            await conn.execute(_ADD_PAYMENT_COLUMNS)
+
+            # Verify
+            result = await conn.fetch(_VERIFY_PAYMENT_COLUMNS)
+
+            columns = "\n".join(f"  - {row['column_name']}: {row['data_type']}" for row in result)
+            if len(result) != 2:
+                raise RuntimeError(f"Migration may have failed - columns not found. Found:\n{columns or '  (none)'}")
+
+        # Report the outcome in a single write, once the check has passed
+        print(f"✅ Columns added successfully\n\n✅ Verification:\n{columns}")
+
+        print("\n✅ Migration completed successfully!")
 
     except Exception as e:
         print(f"❌ Error running migration: {e}")